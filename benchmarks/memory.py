@@ -0,0 +1,123 @@
+'''
+Measure the memory held per recorded query.
+
+Compares records.QueryRecord objects against the span objects of
+the DummyTracer from the test suite, carrying the tags our engine
+handlers set on every query span, as well as against plain dicts
+holding the same fields as the records. Results are emitted as
+JSON, as bytes per object and per 100k objects:
+
+    $ python benchmarks/memory.py --output memory_output.txt
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import sqlalchemy
+
+from sqlalchemy_opentracing.fingerprint import get_fingerprint
+from sqlalchemy_opentracing.records import QueryRecord
+from tests.dummies import DummySpan
+
+STATEMENTS = [
+    'SELECT users.id, users.name FROM users WHERE users.id = ?',
+    'INSERT INTO users (name) VALUES (?)',
+    'UPDATE users SET name=? WHERE users.id = ?',
+    'DELETE FROM users WHERE users.id = ?',
+]
+OPERATIONS = ['select', 'insert', 'update', 'delete']
+
+def make_record(i):
+    index = i % len(STATEMENTS)
+    fingerprint = get_fingerprint(STATEMENTS[index])
+    return QueryRecord(time.time(), 0.001, OPERATIONS[index], 'sqlite',
+                       fingerprint[1], False)
+
+def make_dict(i):
+    index = i % len(STATEMENTS)
+    fingerprint = get_fingerprint(STATEMENTS[index])
+    return {
+        'timestamp': time.time(),
+        'duration': 0.001,
+        'operation': OPERATIONS[index],
+        'dialect': 'sqlite',
+        'fingerprint': fingerprint[1],
+        'error': False,
+    }
+
+def make_span(i):
+    index = i % len(STATEMENTS)
+    fingerprint = get_fingerprint(STATEMENTS[index])
+    span = DummySpan(OPERATIONS[index], start_time=time.time())
+    span.set_tag('component', 'sqlalchemy')
+    span.set_tag('db.type', 'sql')
+    span.set_tag('sqlalchemy.dialect', 'sqlite')
+    span.set_tag('db.statement', STATEMENTS[index])
+    span.set_tag('db.statement.fingerprint', fingerprint[1])
+    span.finish(time.time())
+    return span
+
+SCENARIOS = [
+    ('query_record', make_record),
+    ('dict', make_dict),
+    ('span', make_span),
+]
+
+def measure(factory, count):
+    # Warm the fingerprints cache up, so it's not accounted.
+    factory(0)
+
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    objects = [factory(i) for i in range(count)]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Leave the list itself out, as any buffer holds one.
+    size = end - start - sys.getsizeof(objects)
+    del objects
+    return size
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, default=100000,
+                        help='objects created per scenario')
+    parser.add_argument('--output', default=None,
+                        help='write the JSON results to this file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, factory in SCENARIOS:
+        size = measure(factory, args.count)
+        results[name] = {
+            'bytes_per_object': round(float(size) / args.count, 1),
+            'bytes_per_100k': int(size * 100000.0 / args.count),
+        }
+
+    baseline = results['span']['bytes_per_object']
+    for entry in results.values():
+        entry['ratio_to_span'] = round(entry['bytes_per_object'] / baseline, 3)
+
+    report = {
+        'version': open(os.path.join(ROOT_DIR, 'VERSION')).read().strip(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'count': args.count,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+'''
+Measure the per-execute overhead of the tracing event handlers.
+
+Every scenario runs the same statements against an in-memory SQLite
+database, using the no-op DummyTracer from the test suite, and is
+compared against a baseline run with no handlers registered at all.
+Results are emitted as JSON, so they can be stored and compared
+between releases:
+
+    $ python benchmarks/overhead.py --output bench_output.txt
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import sqlalchemy
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.event import listen, remove
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import sqlalchemy_opentracing
+from tests.dummies import DummySpan, DummyTracer
+
+EXECUTEMANY_ROWS = 10
+
+metadata = MetaData()
+users = Table('users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+)
+missing = Table('missing', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+)
+
+def _params(executemany):
+    if executemany:
+        return [{'name': 'User-%s' % i} for i in range(EXECUTEMANY_ROWS)]
+
+    return {'name': 'John Doe'}
+
+def _setup(engine, tracer, trace_all_queries):
+    sqlalchemy_opentracing.init_tracing(tracer,
+                                        trace_all_engines=False,
+                                        trace_all_queries=trace_all_queries)
+    sqlalchemy_opentracing.register_engine(engine)
+
+def _teardown(engine):
+    sqlalchemy_opentracing.unregister_engine(engine)
+    sqlalchemy_opentracing._clear_tracer()
+
+def run_baseline(engine, tracer, iterations, executemany):
+    params = _params(executemany)
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for i in range(iterations):
+            conn.execute(users.insert(), params)
+        return time.perf_counter() - start
+
+def run_untraced(engine, tracer, iterations, executemany):
+    _setup(engine, tracer, False)
+    try:
+        return run_baseline(engine, tracer, iterations, executemany)
+    finally:
+        _teardown(engine)
+
+def run_trace_all_queries(engine, tracer, iterations, executemany):
+    _setup(engine, tracer, True)
+    try:
+        return run_baseline(engine, tracer, iterations, executemany)
+    finally:
+        _teardown(engine)
+
+def _noop_handler(*args):
+    pass
+
+def run_noop_listeners(engine, tracer, iterations, executemany):
+    # Floor for any instrumentation based on engine events.
+    for event in ('before_cursor_execute', 'after_cursor_execute', 'handle_error'):
+        listen(engine, event, _noop_handler)
+    try:
+        return run_baseline(engine, tracer, iterations, executemany)
+    finally:
+        for event in ('before_cursor_execute', 'after_cursor_execute', 'handle_error'):
+            remove(engine, event, _noop_handler)
+
+def run_disabled(engine, tracer, iterations, executemany):
+    _setup(engine, tracer, True)
+    sqlalchemy_opentracing.disable_tracing()
+    try:
+        return run_baseline(engine, tracer, iterations, executemany)
+    finally:
+        sqlalchemy_opentracing.enable_tracing()
+        _teardown(engine)
+
+def run_set_traced(engine, tracer, iterations, executemany):
+    _setup(engine, tracer, False)
+    params = _params(executemany)
+    try:
+        with engine.connect() as conn:
+            start = time.perf_counter()
+            for i in range(iterations):
+                ins = users.insert()
+                sqlalchemy_opentracing.set_traced(ins)
+                conn.execute(ins, params)
+            return time.perf_counter() - start
+    finally:
+        _teardown(engine)
+
+def run_session_traced(engine, tracer, iterations, executemany):
+    _setup(engine, tracer, False)
+    params = _params(executemany)
+    session = sessionmaker(bind=engine)()
+    try:
+        start = time.perf_counter()
+        sqlalchemy_opentracing.set_parent_span(session, DummySpan('parent'))
+        for i in range(iterations):
+            session.execute(users.insert(), params)
+        session.commit()
+        return time.perf_counter() - start
+    finally:
+        session.close()
+        _teardown(engine)
+
+def run_error_baseline(engine, tracer, iterations, executemany):
+    params = _params(executemany)
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for i in range(iterations):
+            try:
+                conn.execute(missing.insert(), params)
+            except OperationalError:
+                pass
+        return time.perf_counter() - start
+
+def run_error(engine, tracer, iterations, executemany):
+    _setup(engine, tracer, True)
+    try:
+        return run_error_baseline(engine, tracer, iterations, executemany)
+    finally:
+        _teardown(engine)
+
+# (name, runner, baseline name, reference name)
+# The reference, if any, is the floor the scenario is expected to
+# stay close to, with its overhead against it reported as well.
+SCENARIOS = [
+    ('baseline', run_baseline, None, None),
+    ('untraced', run_untraced, 'baseline', None),
+    ('trace_all_queries', run_trace_all_queries, 'baseline', None),
+    ('noop_listeners', run_noop_listeners, 'baseline', None),
+    ('disabled', run_disabled, 'baseline', 'noop_listeners'),
+    ('set_traced', run_set_traced, 'baseline', None),
+    ('session_traced', run_session_traced, 'baseline', None),
+    ('error_baseline', run_error_baseline, None, None),
+    ('error', run_error, 'error_baseline', None),
+]
+
+def measure(runner, iterations, repeat, executemany):
+    '''
+    Run a scenario ``repeat`` times against a fresh database,
+    returning the best observed time per execute call, in seconds.
+    '''
+    best = None
+    for i in range(repeat):
+        engine = create_engine('sqlite:///:memory:')
+        metadata.create_all(engine)
+        tracer = DummyTracer()
+
+        elapsed = runner(engine, tracer, iterations, executemany)
+        engine.dispose()
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best / iterations
+
+def run(iterations, repeat, scenarios=SCENARIOS):
+    results = []
+    for mode in ('execute', 'executemany'):
+        executemany = mode == 'executemany'
+        timings = {}
+        for name, runner, baseline, reference in scenarios:
+            per_op = measure(runner, iterations, repeat, executemany)
+            timings[name] = per_op
+
+            result = {
+                'scenario': name,
+                'mode': mode,
+                'per_execute_us': per_op * 1e6,
+                'overhead_us': None,
+                'overhead_pct': None,
+            }
+            if baseline is not None:
+                base = timings[baseline]
+                result['overhead_us'] = (per_op - base) * 1e6
+                result['overhead_pct'] = (per_op - base) / base * 100.0
+            if reference is not None:
+                ref = timings[reference]
+                result['reference'] = reference
+                result['reference_overhead_us'] = (per_op - ref) * 1e6
+                result['reference_overhead_pct'] = (per_op - ref) / ref * 100.0
+
+            results.append(result)
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='execute calls per scenario run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per scenario, keeping the best one')
+    parser.add_argument('--output', default=None,
+                        help='write the JSON results to this file')
+    args = parser.parse_args(argv)
+
+    report = {
+        'version': open(os.path.join(ROOT_DIR, 'VERSION')).read().strip(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'iterations': args.iterations,
+        'repeat': args.repeat,
+        'executemany_rows': EXECUTEMANY_ROWS,
+        'results': run(args.iterations, args.repeat),
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
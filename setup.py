@@ -13,6 +13,7 @@ setup(
     long_description=open('README.rst').read(),
     packages=['sqlalchemy_opentracing'],
     platforms='any',
+    python_requires='>=3.7',
     install_requires=[
         'sqlalchemy',
         'opentracing>=1.1,<=1.3'
@@ -22,6 +23,13 @@ setup(
         'License :: OSI Approved :: BSD License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ]
 )
@@ -1,41 +1,195 @@
+import contextvars
+import logging
+import os
+import time
+import weakref
+from functools import lru_cache
+
 from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.event import contains, listen, remove
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, object_mapper
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+except ImportError: # SQLAlchemy < 1.4
+    AsyncConnection = AsyncEngine = AsyncSession = None
+
+from . import pooling
+from .budget import ACTION_RAISE, ACTION_TAG, ACTION_WARN, QueryBudget, QueryBudgetExceeded
+from .config import TracingConfig
+from .cursor import TracedCursor
+from .fingerprint import get_fingerprint
+from .records import QueryRecord
+from .registry import TracingRegistry
+from .stats import CompiledCacheStats
+from .transaction import OUTCOME_COMMIT, OUTCOME_RELEASE, OUTCOME_ROLLBACK, TransactionSpans
 
-g_tracer = None
-g_trace_all_queries = False
+g_enabled = True
+g_config = TracingConfig(None, trace_all_queries=False)
 g_trace_all_engines = False
+g_stmt_cache_max_length = 4096
+g_registry = TracingRegistry()
+g_span_scopes = TracingRegistry()
+g_budgets = TracingRegistry()
+g_transactions = TracingRegistry()
+
+# Engine -> _EngineTracing
+g_engines = weakref.WeakKeyDictionary()
+g_disabled_engines = weakref.WeakSet()
+
+# Engine -> CompiledCacheStats
+g_compiled_cache_stats = weakref.WeakKeyDictionary()
+
+# Connection -> weakref to its Session, for traced flushes.
+g_flush_sessions = weakref.WeakKeyDictionary()
+g_current_span = contextvars.ContextVar('sqlalchemy_opentracing_current_span',
+                                        default=None)
+g_execute_start_time = contextvars.ContextVar('sqlalchemy_opentracing_execute_start_time',
+                                              default=None)
+
+TRUNCATED_STMT_MARKER = '...'
+
+FLUSH_SPAN_KEY = 'sqlalchemy_opentracing.flush_span'
+
+TRANSACTION_EVENTS = ('begin', 'commit', 'rollback', 'savepoint',
+                      'rollback_savepoint', 'release_savepoint')
 
-def init_tracing(tracer, trace_all_engines=True, trace_all_queries=True):
+# Names of the compiled cache status of the execution contexts.
+COMPILED_CACHE_STATUSES = {
+    'CACHE_HIT': 'hit',
+    'CACHE_MISS': 'miss',
+    'CACHING_DISABLED': 'disabled',
+    'NO_CACHE_KEY': 'no_key',
+    'NO_DIALECT_SUPPORT': 'unsupported',
+}
+
+# Distinct statements counted per parent span/Session for N+1 detection.
+N_PLUS_ONE_MAX_KEYS = 1000
+
+logger = logging.getLogger(__name__)
+
+def init_tracing(tracer, trace_all_engines=True, trace_all_queries=True,
+                 sample_rate=1.0, operation_sample_rates=None,
+                 slow_query_threshold=None,
+                 stmt_cache_size=1024, stmt_cache_max_length=4096,
+                 max_statement_length=None, fingerprint_statements=False,
+                 query_stats=None, trace_fetch=False,
+                 n_plus_one_threshold=None, n_plus_one_callback=None,
+                 trace_flushes=False, trace_compilation=False,
+                 trace_transactions=False, query_recorder=None):
     '''
     Set our global tracer.
     Tracer objects from our pyramid/flask/django libraries
     can be passed as well.
-    '''
-    global g_tracer, g_trace_all_engines, g_trace_all_queries
 
-    if hasattr(tracer, '_tracer'):
-        tracer = tracer._tracer
+    All the options but trace_all_engines, the statements cache and
+    trace_flushes ones make up the config.TracingConfig object of all
+    the engines registered without their own (see register_engine()).
+
+    sample_rate is the fraction (from 0.0 to 1.0) of the queries that
+    get traced, and operation_sample_rates optionally overrides it
+    per operation name, such as {'select': 0.01, 'insert': 1.0}.
+    The sampling decision is taken before any span gets created.
+
+    If slow_query_threshold (in seconds) is specified, only queries
+    lasting at least that long, or failing, get a span - created
+    once they are done, with a backdated start time.
+
+    Normalized statements are kept in a LRU cache holding up to
+    stmt_cache_size entries, with statements longer than
+    stmt_cache_max_length not being cached at all.
+
+    If max_statement_length is specified, longer statements are
+    truncated before being reported, with their original length
+    being reported in the db.statement.length tag.
+
+    If fingerprint_statements is True, the hash of the literal-free
+    form of the statements is reported in the
+    db.statement.fingerprint tag.
 
-    g_tracer = tracer
-    g_trace_all_queries = trace_all_queries
+    query_stats is an optional stats.QueryStats object, aggregating
+    the latency of all the queries of the registered engines. In such
+    case, tracer can be None, to only gather statistics.
+
+    If trace_fetch is True, spans are kept open till the query
+    results are exhausted or closed, having the execute and fetch
+    times, as well as the fetched rows, reported as tags. This is
+    always done for streamed results (stream_results or yield_per).
+
+    If n_plus_one_threshold is specified, statements (by fingerprint)
+    executed more than that number of times under the same traced
+    Session/Connection transaction, or parent span, get their spans
+    tagged with sqlalchemy.n_plus_one, and a warning is logged.
+    n_plus_one_callback, if any, is called instead of logging, with
+    the fingerprint, count and parent span as parameters.
+
+    If trace_flushes is True, ORM Session flushes get their own span,
+    tagged with the number of new, dirty and deleted objects, and
+    being the parent of the spans of the flushed statements.
+
+    If trace_compilation is True, spans are tagged with the time
+    spent compiling their statement (along with processing its
+    parameters) and its SQLAlchemy compiled cache status, with the
+    latter being aggregated per engine as well (see
+    get_compiled_cache_stats()). It applies to the engines
+    registered afterwards.
+
+    If trace_transactions is True, the transactions of traced
+    Connections/Sessions get a span, from their begin (or the moment
+    they get traced) till their commit/rollback, with their savepoints
+    getting a nested one. They are tagged with their outcome, the
+    number of statements and the time spent idle between them. It
+    applies to the engines registered afterwards.
+
+    query_recorder is an optional object with a record() method,
+    called with a compact records.QueryRecord for every query of the
+    registered engines, such as records.QueryRecordBuffer. As with
+    query_stats, tracer can be None in such case.
+    '''
+    global g_config, g_trace_all_engines
+    global g_stmt_cache, g_stmt_cache_max_length
+
+    g_config = TracingConfig(tracer, trace_all_queries, sample_rate,
+                             operation_sample_rates,
+                             slow_query_threshold=slow_query_threshold,
+                             max_statement_length=max_statement_length,
+                             fingerprint_statements=fingerprint_statements,
+                             query_stats=query_stats,
+                             trace_fetch=trace_fetch,
+                             n_plus_one_threshold=n_plus_one_threshold,
+                             n_plus_one_callback=n_plus_one_callback,
+                             trace_compilation=trace_compilation,
+                             trace_transactions=trace_transactions,
+                             query_recorder=query_recorder)
     g_trace_all_engines = trace_all_engines
+    g_stmt_cache = lru_cache(maxsize=stmt_cache_size)(_normalize_stmt_uncached)
+    g_stmt_cache_max_length = stmt_cache_max_length
+
+    _set_flush_events(trace_flushes)
 
     if trace_all_engines:
         register_engine(Engine)
 
+        # Engines with their own config would be traced twice.
+        for engine, entry in list(g_engines.items()):
+            if contains(engine, 'before_cursor_execute', _engine_before_cursor_handler):
+                _remove_engine_listeners(engine)
+                if entry.explicit:
+                    _listen_optional_events(engine, entry.config)
+
 def get_traced(obj):
     '''
     Gets a bool indicating whether or not this
     object is marked for tracing.
     '''
-    return getattr(obj, '_traced', False)
+    return g_registry.get(_get_sync_proxy(obj)) is not None
 
 def set_traced(obj):
     '''
     Mark a statement/session to be traced.
     '''
-    obj._traced = True
+    obj = _get_sync_proxy(obj)
+    g_registry.setdefault(obj)
 
     if isinstance(obj, Session):
         # Session needs to have its connection/statements
@@ -46,28 +200,33 @@ def set_traced(obj):
         # after commit/rollback.
         _register_connection_events(obj)
 
+        if obj.in_transaction():
+            _start_transaction_span(obj)
+
 def clear_traced(obj):
     '''
-    Clear an object's decorated tracing fields,
+    Clear an object's tracing information,
     to prevent unintended further tracing.
     '''
-    if hasattr(obj, '_parent_span'):
-        del obj._parent_span
-    if hasattr(obj, '_traced'):
-        del obj._traced
+    g_registry.pop(_get_sync_proxy(obj))
 
 def get_parent_span(obj):
     '''
     Gets a parent span for this object, if any.
     '''
-    return getattr(obj, '_parent_span', None)
+    state = g_registry.get(_get_sync_proxy(obj))
+    if state is None:
+        return None
+
+    return state.get_parent_span()
 
 def set_parent_span(obj, parent_span):
     '''
     Marks an object as a child of a span.
     It gets marked to be traced if it wasn't before.
     '''
-    obj._parent_span = parent_span
+    obj = _get_sync_proxy(obj)
+    g_registry.setdefault(obj).parent_span = parent_span
     set_traced(obj)
 
 def has_parent_span(obj):
@@ -75,35 +234,280 @@ def has_parent_span(obj):
     Get whether or not the statement has
     a parent span.
     '''
-    return hasattr(obj, '_parent_span')
+    state = g_registry.get(_get_sync_proxy(obj))
+    return state is not None and state.has_parent_span()
+
+def get_current_span():
+    '''
+    Gets the span set as the current one
+    for this thread/asyncio task, if any.
+    '''
+    return g_current_span.get()
+
+def set_current_span(span):
+    '''
+    Set the span being the implicit parent of the queries
+    run under the current thread/asyncio task, when no parent
+    span was explicitly set for them. Queries get traced if
+    there is a current span. Returns a token for
+    reset_current_span().
+    '''
+    return g_current_span.set(span)
 
-def register_engine(obj):
+def reset_current_span(token):
     '''
-    Register an engine to have its events be traced.
+    Restore the current span to the one set
+    before the call returning token.
     '''
-    if g_tracer is None:
+    g_current_span.reset(token)
+
+def register_engine(obj, config=None):
+    '''
+    Register an engine to have its events be traced, optionally
+    with its own config.TracingConfig object instead of the global
+    configuration. Engines can be registered with their own
+    config even when tracing all engines. Engines derived through
+    execution_options() share the configuration of their engine.
+    '''
+    obj = _get_base_engine(_get_sync_proxy(obj))
+    if config is not None:
+        if obj == Engine:
+            raise RuntimeError('A config can only be set for engine objects')
+
+        g_engines[obj] = _EngineTracing(obj, config, explicit=True)
+    elif g_config.tracer is None and not g_config.recording:
         raise RuntimeError('The tracer is not properly set')
-    if g_trace_all_engines and obj != Engine:
+    elif g_trace_all_engines and obj != Engine:
         raise RuntimeError('Tracing all engines already')
+    else:
+        config = g_config
+
+    # Tracing all engines already, except for
+    # the events only needed by its own config.
+    if g_trace_all_engines and obj != Engine:
+        _listen_optional_events(obj, config)
+        return
 
     listen(obj, 'before_cursor_execute', _engine_before_cursor_handler)
     listen(obj, 'after_cursor_execute', _engine_after_cursor_handler)
     listen(obj, 'handle_error', _engine_error_handler)
+    _listen_optional_events(obj, config)
 
 def unregister_engine(obj):
     '''
     Remove an engine from having its events being traced.
     '''
-    remove(obj, 'before_cursor_execute', _engine_before_cursor_handler)
-    remove(obj, 'after_cursor_execute', _engine_after_cursor_handler)
-    remove(obj, 'handle_error', _engine_error_handler)
+    obj = _get_base_engine(_get_sync_proxy(obj))
+    if obj != Engine:
+        g_engines.pop(obj, None)
+
+    _remove_engine_listeners(obj)
+
+def register_pool(obj):
+    '''
+    Register the connection pool of an engine, so checkout
+    wait time, pool usage and connection age get reported as tags
+    of the first span of each connection checkout.
+    '''
+    pooling.instrument_engine_pool(_get_sync_proxy(obj), is_tracing_enabled)
+
+def unregister_pool(obj):
+    '''
+    Remove the connection pool of an engine from being traced.
+    '''
+    pooling.uninstrument_engine_pool(_get_sync_proxy(obj))
+
+def set_query_budget(obj, max_queries=None, max_db_time=None,
+                     action=ACTION_TAG):
+    '''
+    Set a budget of queries and time spent on them (in seconds)
+    for a parent span, Session or Connection, replacing any previous
+    one, and return it. action can be 'tag', 'warn' or 'raise'.
+    '''
+    obj = _get_sync_proxy(obj)
+    budget = QueryBudget(max_queries, max_db_time, action)
+    g_budgets.setdefault(obj).budget = budget
+
+    if isinstance(obj, Session):
+        _register_session_budget_events(obj)
+
+    return budget
+
+def get_query_budget(obj):
+    '''
+    Gets the query budget of this object, if any.
+    '''
+    state = g_budgets.get(_get_sync_proxy(obj))
+    if state is None:
+        return None
+
+    return state.budget
+
+def clear_query_budget(obj):
+    '''
+    Remove the query budget of this object, if any.
+    '''
+    state = g_budgets.pop(_get_sync_proxy(obj))
+    if state is not None:
+        # Session connections may still be referencing it.
+        state.budget = None
+
+def enable_tracing(engine=None):
+    '''
+    Resume tracing after disable_tracing(), either
+    globally or for a single engine.
+    '''
+    global g_enabled
+    if engine is None:
+        g_enabled = True
+    else:
+        g_disabled_engines.discard(_get_base_engine(_get_sync_proxy(engine)))
+
+def disable_tracing(engine=None):
+    '''
+    Stop tracing (as well as gathering statistics and accounting
+    budgets), either globally or for a single engine, with the
+    handlers returning right away. Unlike unregister_engine(),
+    this is cheap and safe to do while queries are running,
+    although those in flight may not get reported.
+    '''
+    global g_enabled
+    if engine is None:
+        g_enabled = False
+    else:
+        g_disabled_engines.add(_get_base_engine(_get_sync_proxy(engine)))
+
+def is_tracing_enabled(engine=None):
+    '''
+    Get whether tracing is enabled, either
+    globally or for a single engine.
+    '''
+    if engine is None:
+        return g_enabled
+
+    return g_enabled and \
+        _get_base_engine(_get_sync_proxy(engine)) not in g_disabled_engines
+
+def get_compiled_cache_stats(engine, reset=False):
+    '''
+    Gets the number of statements of an engine per SQLAlchemy
+    compiled cache status ('hit', 'miss', 'disabled', 'no_key',
+    'unsupported'), along with the cache hit ratio as 'hit_ratio',
+    optionally resetting them afterwards. Requires init_tracing()
+    to be called with trace_compilation=True.
+    '''
+    stats = g_compiled_cache_stats.get(_get_base_engine(_get_sync_proxy(engine)))
+    if stats is None:
+        stats = CompiledCacheStats()
+
+    return stats.snapshot(reset=reset)
+
+def get_stmt_cache_info():
+    '''
+    Gets the hits, misses, maxsize and currsize
+    statistics of the normalized statements cache.
+    '''
+    return g_stmt_cache.cache_info()
 
 def _clear_tracer():
     '''
     Set the tracer to None. For test cases usage.
     '''
-    global g_tracer
-    g_tracer = None
+    global g_enabled, g_config, g_trace_all_engines
+    g_enabled = True
+    g_disabled_engines.clear()
+    g_config = TracingConfig(None, trace_all_queries=False)
+    g_trace_all_engines = False
+    g_engines.clear()
+    g_compiled_cache_stats.clear()
+    g_registry.clear()
+    g_span_scopes.clear()
+    g_budgets.clear()
+    g_transactions.clear()
+    _set_flush_events(False)
+
+class _EngineTracing(object):
+    '''
+    Configuration of an engine, along with its static tags.
+    '''
+    __slots__ = ('config', 'static_tags', 'explicit')
+
+    def __init__(self, engine, config, explicit=False):
+        self.config = config
+        self.static_tags = config.get_static_tags(engine)
+        self.explicit = explicit
+
+def _get_engine_tracing(engine):
+    # Engines using the global configuration get their entry
+    # on their first query, and rebuilt if init_tracing() is
+    # called again.
+    engine = _get_base_engine(engine)
+    entry = g_engines.get(engine)
+    if entry is None or not (entry.explicit or entry.config is g_config):
+        entry = _EngineTracing(engine, g_config)
+        g_engines[engine] = entry
+
+    return entry
+
+def _listen_optional_events(obj, config):
+    '''
+    Register the compilation and transaction events, if needed by
+    config, unless already done for obj or all the engines.
+    '''
+    if config.trace_compilation and \
+            not contains(Engine, 'before_execute', _engine_before_execute_handler) and \
+            not contains(obj, 'before_execute', _engine_before_execute_handler):
+        listen(obj, 'before_execute', _engine_before_execute_handler)
+
+    begin_handler = g_transaction_handlers['begin']
+    if config.trace_transactions and \
+            not contains(Engine, 'begin', begin_handler) and \
+            not contains(obj, 'begin', begin_handler):
+        for event in TRANSACTION_EVENTS:
+            listen(obj, event, g_transaction_handlers[event])
+
+def _remove_engine_listeners(obj):
+    if contains(obj, 'before_cursor_execute', _engine_before_cursor_handler):
+        remove(obj, 'before_cursor_execute', _engine_before_cursor_handler)
+        remove(obj, 'after_cursor_execute', _engine_after_cursor_handler)
+        remove(obj, 'handle_error', _engine_error_handler)
+    if contains(obj, 'before_execute', _engine_before_execute_handler):
+        remove(obj, 'before_execute', _engine_before_execute_handler)
+    if contains(obj, 'begin', g_transaction_handlers['begin']):
+        for event in TRANSACTION_EVENTS:
+            remove(obj, event, g_transaction_handlers[event])
+
+def _get_sync_proxy(obj):
+    '''
+    Get the sync Engine/Connection/Session an asyncio
+    one proxies to, or the object itself otherwise.
+    '''
+    if AsyncEngine is None:
+        return obj
+
+    if isinstance(obj, AsyncEngine):
+        return obj.sync_engine
+    if isinstance(obj, AsyncSession):
+        return obj.sync_session
+    if isinstance(obj, AsyncConnection):
+        if obj.sync_connection is None:
+            raise RuntimeError('The AsyncConnection has not been started')
+        return obj.sync_connection
+
+    return obj
+
+def _get_base_engine(engine):
+    '''
+    Get the Engine an OptionEngine (as created by
+    execution_options()) derives from, or the object itself
+    otherwise. Per-engine state is kept for the former.
+    '''
+    proxied = getattr(engine, '_proxied', None)
+    while proxied is not None:
+        engine = proxied
+        proxied = getattr(engine, '_proxied', None)
+
+    return engine
 
 def _can_operation_be_traced(conn, stmt_obj):
     '''
@@ -111,21 +515,33 @@ def _can_operation_be_traced(conn, stmt_obj):
     connection or the statement being executed, having the latter
     the priority.
     '''
-    if hasattr(stmt_obj, '_traced'):
-        return stmt_obj._traced
-    if hasattr(conn, '_traced'):
-        return conn._traced
-
-    return False
+    return g_registry.get(stmt_obj) is not None or \
+        g_registry.get(conn) is not None
 
 def _set_traced_with_session(conn, session):
     '''
     Mark a connection to be traced with a session tracing information.
     '''
-    conn._traced = True
+    state = g_registry.setdefault(conn)
+    state.session_state = g_registry.get(session)
     parent_span = get_parent_span(session)
     if parent_span is not None:
-        conn._parent_span = parent_span
+        state.parent_span = parent_span
+
+    # Called right after the transaction begins.
+    _start_transaction_span(conn)
+
+def _get_statement_object(context):
+    if context.compiled is None:
+        return None
+
+    # Compiled forms are cached and shared by statements of the same
+    # shape, so prefer the statement actually being executed.
+    stmt_obj = getattr(context, 'invoked_statement', None)
+    if stmt_obj is None:
+        stmt_obj = context.compiled.statement
+
+    return stmt_obj
 
 def _get_operation_name(stmt_obj):
     if stmt_obj is None:
@@ -135,66 +551,428 @@ def _get_operation_name(stmt_obj):
 
     return stmt_obj.__visit_name__
 
-def _normalize_stmt(statement):
+def _is_streaming(context):
+    '''
+    Get whether the results of a query are
+    streamed (such as server side cursors).
+    '''
+    options = context.execution_options
+    return bool(options.get('stream_results') or options.get('yield_per'))
+
+def _normalize_stmt_uncached(statement):
     return statement.strip().replace('\n', '').replace('\t', '')
 
+g_stmt_cache = lru_cache(maxsize=1024)(_normalize_stmt_uncached)
+
+def _normalize_stmt(statement):
+    # Huge statements (bulk inserts, long IN lists)
+    # would bloat the cache, so skip it for them.
+    if len(statement) > g_stmt_cache_max_length:
+        return _normalize_stmt_uncached(statement)
+
+    return g_stmt_cache(statement)
+
+def _engine_before_execute_handler(conn, clauseelement, multiparams,
+                                   params, execution_options):
+    if not g_enabled or (g_disabled_engines and
+                         _get_base_engine(conn.engine) in g_disabled_engines):
+        return
+
+    # The statement gets compiled right after this.
+    g_execute_start_time.set(time.monotonic())
+
+def _account_compilation(engine, context):
+    start_time = g_execute_start_time.get()
+    if start_time is not None:
+        g_execute_start_time.set(None)
+
+    # Nothing compiled for raw SQL.
+    if context.compiled is None:
+        return
+
+    if start_time is not None:
+        context._compile_time = time.monotonic() - start_time
+
+    cache_hit = getattr(context, 'cache_hit', None)
+    if cache_hit is None:
+        return
+
+    status = COMPILED_CACHE_STATUSES.get(getattr(cache_hit, 'name', None))
+    if status is None:
+        return
+
+    context._compiled_cache_status = status
+
+    stats = g_compiled_cache_stats.get(engine)
+    if stats is None:
+        stats = g_compiled_cache_stats.setdefault(engine, CompiledCacheStats())
+    stats.record(status)
+
 def _engine_before_cursor_handler(conn, cursor,
                                        statement, parameters,
                                        context, executemany):
-    stmt_obj = None
-    if context.compiled is not None:
-        stmt_obj = context.compiled.statement
+    if not g_enabled:
+        return
+
+    engine = _get_base_engine(conn.engine)
+    if g_disabled_engines and engine in g_disabled_engines:
+        return
+
+    stmt_obj = _get_statement_object(context)
+    engine_tracing = _get_engine_tracing(engine)
+    config = engine_tracing.config
 
-    # Don't trace if trace_all is disabled
+    if config.trace_compilation:
+        _account_compilation(engine, context)
+
+    if config.trace_transactions:
+        state = g_transactions.get(conn)
+        if state is not None and state.transactions is not None:
+            state.transactions.statement_started()
+            context._transactions = state.transactions
+
+    if config.recording:
+        context._stats_config = config
+        context._stats_start_time = time.monotonic()
+
+    # Budgets account all the queries, traced or not.
+    if g_budgets:
+        _account_query_budget(conn, stmt_obj, context)
+
+    if config.tracer is None:
+        return
+
+    # Don't trace if trace_all is disabled, there's no current span,
     # and the connection/statement wasn't marked explicitly.
-    if not (g_trace_all_queries or _can_operation_be_traced(conn, stmt_obj)):
+    if not (config.trace_all_queries or
+            g_current_span.get() is not None or
+            _can_operation_be_traced(conn, stmt_obj)):
         return
 
     # Don't trace PRAGMA statements coming from SQLite
     if stmt_obj is None and statement.startswith('PRAGMA'):
         return
 
-    # Retrieve the parent span, if any,
-    # either from the statement or inherited from the connection.
+    if config.statement_filter is not None and \
+            not config.statement_filter(statement):
+        if stmt_obj is not None:
+            clear_traced(stmt_obj)
+        return
+
+    if config.n_plus_one_threshold is not None:
+        _detect_n_plus_one(conn, stmt_obj, statement, context, config)
+
+    # Decide on sampling before doing any actual work.
+    name = _get_operation_name(stmt_obj)
+    if config.sampling and not config.is_sampled(name):
+        # Statements are traced only once, sampled or not.
+        if stmt_obj is not None:
+            clear_traced(stmt_obj)
+        return
+
+    # Only take the starting time if we are tracing slow queries,
+    # and decide whether to create a span once the query is done.
+    context._engine_tracing = engine_tracing
+    if config.slow_query_threshold is not None:
+        context._start_time = time.monotonic()
+        return
+
+    if config.trace_fetch or _is_streaming(context):
+        context._start_time = time.monotonic()
+
+    context._span = _start_query_span(conn, stmt_obj, name, statement,
+                                      context, engine_tracing)
+
+def _get_query_parent_span(conn, stmt_obj):
+    # Retrieve the parent span, if any, either from the statement,
+    # inherited from the connection, or the current one.
+    # Statements run by a traced flush belong to it.
     parent_span = get_parent_span(stmt_obj)
+    if parent_span is None and g_flush_sessions:
+        parent_span = _get_flush_span(conn)
     if parent_span is None:
         parent_span = get_parent_span(conn)
+    if parent_span is None:
+        parent_span = g_current_span.get()
+
+    return parent_span
+
+def _detect_n_plus_one(conn, stmt_obj, statement, context, config):
+    '''
+    Count the executions of a statement under its traced
+    Session/Connection or parent span, and report it
+    if it exceeds the N+1 threshold.
+    '''
+    parent_span = _get_query_parent_span(conn, stmt_obj)
+
+    # Session/Connection counters are cleared along their tracing
+    # information, and parent span ones once they are released.
+    state = g_registry.get(conn)
+    if state is not None and state.session_state is not None:
+        state = state.session_state
+    if state is None:
+        if parent_span is None:
+            return
+        state = g_span_scopes.setdefault(parent_span)
+
+    counts = state.query_counts
+    if counts is None:
+        counts = state.query_counts = {}
+
+    fingerprint = get_fingerprint(statement)
+    count = counts.get(fingerprint[1], 0) + 1
+    if count == 1 and len(counts) >= N_PLUS_ONE_MAX_KEYS:
+        return
+
+    counts[fingerprint[1]] = count
+    threshold = config.n_plus_one_threshold
+    if count <= threshold:
+        return
+
+    context._n_plus_one_count = count
+    if count == threshold + 1:
+        if config.n_plus_one_callback is not None:
+            config.n_plus_one_callback(fingerprint[0], count, parent_span)
+        else:
+            logger.warning('Possible N+1 query, executed more than %d times: %s',
+                           threshold, fingerprint[0])
+
+def _get_query_budget(conn, stmt_obj):
+    # Connection budgets come first, then the ones of their
+    # session, and lastly the ones of the parent span.
+    state = g_budgets.get(conn)
+    if state is not None:
+        if state.budget is not None:
+            return state.budget
+        if state.session_state is not None and \
+                state.session_state.budget is not None:
+            return state.session_state.budget
+
+    parent_span = _get_query_parent_span(conn, stmt_obj)
+    if parent_span is not None:
+        state = g_budgets.get(parent_span)
+        if state is not None:
+            return state.budget
+
+    return None
+
+def _account_query_budget(conn, stmt_obj, context):
+    budget = _get_query_budget(conn, stmt_obj)
+    if budget is None:
+        return
+
+    context._budget = budget
+    context._budget_start_time = time.monotonic()
+    if budget.add_query():
+        context._budget_exceeded = True
+        _report_budget_exceeded(budget)
+
+def _account_query_budget_time(context, span):
+    budget = context._budget
+    context._budget = None
+
+    duration = time.monotonic() - context._budget_start_time
+    if budget.add_db_time(duration):
+        if span is not None:
+            span.set_tag('sqlalchemy.query_budget_exceeded', True)
+        _report_budget_exceeded(budget)
+
+def _report_budget_exceeded(budget):
+    first_time = not budget.exceeded
+    budget.exceeded = True
+
+    if budget.action == ACTION_RAISE:
+        raise QueryBudgetExceeded('Query budget exceeded: %d queries, %.3fs'
+                                  % (budget.queries, budget.db_time), budget)
+    if budget.action == ACTION_WARN and first_time:
+        logger.warning('Query budget exceeded: %d queries, %.3fs',
+                       budget.queries, budget.db_time)
+
+def _start_query_span(conn, stmt_obj, name, statement, context,
+                      engine_tracing, start_time=None):
+    parent_span = _get_query_parent_span(conn, stmt_obj)
+    config = engine_tracing.config
 
     # Start a new span for this query.
-    name = _get_operation_name(stmt_obj)
-    span = g_tracer.start_span(operation_name=name, child_of=parent_span)
-    span.set_tag('component', 'sqlalchemy')
-    span.set_tag('db.type', 'sql')
-    span.set_tag('db.statement', _normalize_stmt(statement))
-    span.set_tag('sqlalchemy.dialect', context.dialect.name)
+    span = config.tracer.start_span(operation_name=name,
+                                    child_of=parent_span,
+                                    start_time=start_time)
+    for key, value in engine_tracing.static_tags:
+        span.set_tag(key, value)
+
+    if pooling.g_instrumented:
+        pool_tags = pooling.pop_pool_tags(conn)
+        if pool_tags is not None:
+            for key, value in pool_tags.items():
+                span.set_tag(key, value)
+
+    if config.fingerprint_statements:
+        span.set_tag('db.statement.fingerprint', get_fingerprint(statement)[1])
+
+    n_plus_one_count = getattr(context, '_n_plus_one_count', None)
+    if n_plus_one_count is not None:
+        span.set_tag('sqlalchemy.n_plus_one', True)
+        span.set_tag('sqlalchemy.n_plus_one.count', n_plus_one_count)
 
+    if getattr(context, '_budget_exceeded', False):
+        span.set_tag('sqlalchemy.query_budget_exceeded', True)
+
+    if config.trace_compilation:
+        compile_time = getattr(context, '_compile_time', None)
+        if compile_time is not None:
+            span.set_tag('sqlalchemy.compile_time', compile_time)
+        status = getattr(context, '_compiled_cache_status', None)
+        if status is not None:
+            span.set_tag('sqlalchemy.compiled_cache', status)
+
+    # Truncate huge statements before doing any work on them.
+    max_length = config.max_statement_length
+    if max_length is not None and len(statement) > max_length:
+        span.set_tag('db.statement.length', len(statement))
+        statement = statement[:max_length]
+        span.set_tag('db.statement',
+                     _normalize_stmt(statement) + TRUNCATED_STMT_MARKER)
+    else:
+        span.set_tag('db.statement', _normalize_stmt(statement))
+
+    return span
+
+def _get_query_span(conn, statement, context, failed):
+    '''
+    Get the span of a finished query, if any. When tracing
+    slow queries, it gets created at this point if the query
+    took too long or failed.
+    '''
+    span = getattr(context, '_span', None)
+    if span is not None:
+        return span
+
+    start_time = getattr(context, '_start_time', None)
+    if start_time is None:
+        return None
+
+    engine_tracing = context._engine_tracing
+    threshold = engine_tracing.config.slow_query_threshold
+    if threshold is None:
+        return None
+
+    stmt_obj = _get_statement_object(context)
+
+    duration = time.monotonic() - start_time
+    if duration < threshold and not failed:
+        if stmt_obj is not None:
+            clear_traced(stmt_obj)
+        return None
+
+    name = _get_operation_name(stmt_obj)
+    span = _start_query_span(conn, stmt_obj, name, statement, context,
+                             engine_tracing,
+                             start_time=time.time() - duration)
     context._span = span
+    return span
+
+def _record_query(statement, context, failed):
+    start_time = getattr(context, '_stats_start_time', None)
+    if start_time is None:
+        return
+
+    # Record it only once, even if failing when fetching results.
+    context._stats_start_time = None
+
+    duration = time.monotonic() - start_time
+    name = _get_operation_name(_get_statement_object(context))
+    fingerprint = get_fingerprint(statement)
+
+    config = context._stats_config
+    if config.query_stats is not None:
+        config.query_stats.record(name, fingerprint, duration, error=failed)
+
+    if config.query_recorder is not None:
+        config.query_recorder.record(QueryRecord(time.time() - duration, duration,
+                                                 name, context.dialect.name,
+                                                 fingerprint[1], failed))
 
 def _engine_after_cursor_handler(conn, cursor,
                                       statement, parameters,
                                       context, executemany):
-    span = getattr(context, '_span', None)
+    if not g_enabled or (g_disabled_engines and
+                         _get_base_engine(conn.engine) in g_disabled_engines):
+        return
+
+    if getattr(context, '_transactions', None) is not None:
+        context._transactions.statement_finished()
+
+    if getattr(context, '_stats_start_time', None) is not None:
+        _record_query(statement, context, failed=False)
+
+    span = _get_query_span(conn, statement, context, failed=False)
+    if getattr(context, '_budget', None) is not None:
+        _account_query_budget_time(context, span)
     if span is None:
         return
 
-    span.finish()
+    streaming = _is_streaming(context)
+    if context._engine_tracing.config.trace_fetch or streaming:
+        start_time = context._start_time
+        traced_cursor = TracedCursor(cursor, span, start_time,
+                                     time.monotonic() - start_time,
+                                     streaming=streaming)
+        if cursor.description is None:
+            # Nothing to fetch.
+            traced_cursor.finish_span()
+        else:
+            # Results are fetched from context.cursor,
+            # which will finish the span once closed.
+            context.cursor = traced_cursor
+    else:
+        span.finish()
 
-    if context.compiled is not None:
-        clear_traced(context.compiled.statement)
+    stmt_obj = _get_statement_object(context)
+    if stmt_obj is not None:
+        clear_traced(stmt_obj)
 
 def _engine_error_handler(exception_context):
+    engine = exception_context.engine
+    if not g_enabled or (g_disabled_engines and
+                         _get_base_engine(engine) in g_disabled_engines):
+        return
+
     execution_context = exception_context.execution_context
-    span = getattr(execution_context, '_span', None)
+    if execution_context is None:
+        return
+
+    if getattr(execution_context, '_transactions', None) is not None:
+        execution_context._transactions.statement_finished()
+
+    if getattr(execution_context, '_stats_start_time', None) is not None:
+        _record_query(exception_context.statement,
+                      execution_context, failed=True)
+
+    span = _get_query_span(exception_context.connection,
+                           exception_context.statement,
+                           execution_context, failed=True)
+    if getattr(execution_context, '_budget', None) is not None:
+        # Failing queries count against the budget, but
+        # don't raise over the actual error.
+        execution_context._budget.add_db_time(
+            time.monotonic() - execution_context._budget_start_time)
+        execution_context._budget = None
     if span is None:
         return
 
     exc = exception_context.original_exception
     span.set_tag('sqlalchemy.exception', str(exc))
     span.set_tag('error', 'true')
-    span.finish()
 
-    if execution_context.compiled is not None:
-        clear_traced(execution_context.compiled.statement)
+    # Failed while fetching results.
+    if isinstance(getattr(execution_context, 'cursor', None), TracedCursor):
+        execution_context.cursor.finish_span()
+    else:
+        span.finish()
+
+    stmt_obj = _get_statement_object(execution_context)
+    if stmt_obj is not None:
+        clear_traced(stmt_obj)
 
 def _register_connection_events(conn):
     '''
@@ -231,6 +1009,16 @@ def _register_session_events(session):
     listen(session, 'after_commit', _session_cleanup_handler)
     listen(session, 'after_rollback', _session_cleanup_handler)
 
+def _register_session_budget_events(session):
+    '''
+    Register the events passing down the budget of
+    our session to its connections, only once.
+    '''
+    if contains(session, 'after_begin', _session_budget_begin_handler):
+        return
+
+    listen(session, 'after_begin', _session_budget_begin_handler)
+
 def _connection_cleanup_handler(conn):
     clear_traced(conn)
 
@@ -240,6 +1028,241 @@ def _session_after_begin_handler(session, transaction, conn):
     if get_traced(session):
         _set_traced_with_session(conn, session)
 
+def _session_budget_begin_handler(session, transaction, conn):
+    state = g_budgets.get(session)
+    if state is not None:
+        g_budgets.setdefault(conn).session_state = state
+
 def _session_cleanup_handler(session):
     clear_traced(session)
 
+def _start_transaction_span(conn):
+    '''
+    Start the span of the current transaction of
+    a traced connection, if not done already.
+    '''
+    state = g_transactions.get(conn)
+    if state is not None and state.transactions is not None:
+        return
+
+    engine_tracing = _get_transaction_tracing(conn)
+    if engine_tracing is None:
+        return
+
+    parent_span = get_parent_span(conn)
+    if parent_span is None:
+        parent_span = g_current_span.get()
+
+    span = _start_transaction_span_object(engine_tracing, 'transaction',
+                                          parent_span)
+    g_transactions.setdefault(conn).transactions = TransactionSpans(span)
+
+def _get_transaction_tracing(conn):
+    if not g_enabled:
+        return None
+
+    engine = _get_base_engine(conn.engine)
+    if g_disabled_engines and engine in g_disabled_engines:
+        return None
+
+    engine_tracing = _get_engine_tracing(engine)
+    config = engine_tracing.config
+    if config.tracer is None or not config.trace_transactions:
+        return None
+
+    return engine_tracing
+
+def _start_transaction_span_object(engine_tracing, name, parent_span):
+    span = engine_tracing.config.tracer.start_span(operation_name=name,
+                                                   child_of=parent_span)
+    for key, value in engine_tracing.static_tags:
+        span.set_tag(key, value)
+
+    return span
+
+def _get_transactions(conn):
+    state = g_transactions.get(conn)
+    if state is None:
+        return None
+
+    return state.transactions
+
+def _transaction_begin_handler(conn):
+    # Connections traced before beginning a transaction.
+    if g_registry.get(conn) is not None:
+        _start_transaction_span(conn)
+
+def _transaction_commit_handler(conn):
+    _end_transaction(conn, OUTCOME_COMMIT)
+
+def _transaction_rollback_handler(conn):
+    _end_transaction(conn, OUTCOME_ROLLBACK)
+
+def _end_transaction(conn, outcome):
+    state = g_transactions.pop(conn)
+    if state is not None and state.transactions is not None:
+        state.transactions.end(outcome)
+
+def _transaction_savepoint_handler(conn, name):
+    transactions = _get_transactions(conn)
+    if transactions is None:
+        return
+
+    engine_tracing = _get_transaction_tracing(conn)
+    if engine_tracing is None:
+        return
+
+    span = _start_transaction_span_object(engine_tracing, 'nested_transaction',
+                                          transactions.current_span)
+    transactions.begin_savepoint(span, name)
+
+def _transaction_rollback_savepoint_handler(conn, name, context):
+    transactions = _get_transactions(conn)
+    if transactions is not None:
+        transactions.end_savepoint(name, OUTCOME_ROLLBACK)
+
+def _transaction_release_savepoint_handler(conn, name, context):
+    transactions = _get_transactions(conn)
+    if transactions is not None:
+        transactions.end_savepoint(name, OUTCOME_RELEASE)
+
+g_transaction_handlers = {
+    'begin': _transaction_begin_handler,
+    'commit': _transaction_commit_handler,
+    'rollback': _transaction_rollback_handler,
+    'savepoint': _transaction_savepoint_handler,
+    'rollback_savepoint': _transaction_rollback_savepoint_handler,
+    'release_savepoint': _transaction_release_savepoint_handler,
+}
+
+def _set_flush_events(enabled):
+    '''
+    Register or remove the flush events for all the sessions.
+    '''
+    if enabled == contains(Session, 'before_flush', _session_before_flush_handler):
+        return
+
+    for name, handler in g_flush_handlers:
+        if enabled:
+            listen(Session, name, handler)
+        else:
+            remove(Session, name, handler)
+
+    if not enabled:
+        g_flush_sessions.clear()
+
+def _session_begin_handler(session, transaction, connection):
+    # Statements only know their Connection, so keep track
+    # of the Session each one belongs to.
+    g_flush_sessions[connection] = weakref.ref(session)
+
+def _session_before_flush_handler(session, flush_context, instances):
+    # Flushes with nothing to write end without any further event.
+    _finish_flush_span(session, failed=False)
+
+    if not g_enabled or session.bind is None:
+        return
+
+    engine = _get_base_engine(session.bind.engine)
+    if g_disabled_engines and engine in g_disabled_engines:
+        return
+
+    engine_tracing = _get_engine_tracing(engine)
+    config = engine_tracing.config
+    if config.tracer is None:
+        return
+
+    # Same as for queries, plus the session being explicitly traced.
+    if not (config.trace_all_queries or
+            g_current_span.get() is not None or
+            get_traced(session)):
+        return
+
+    if config.sampling and not config.is_sampled('flush'):
+        return
+
+    parent_span = get_parent_span(session)
+    if parent_span is None:
+        parent_span = g_current_span.get()
+
+    span = config.tracer.start_span(operation_name='flush',
+                                    child_of=parent_span)
+    for key, value in engine_tracing.static_tags:
+        span.set_tag(key, value)
+
+    for state, objects in (('new', session.new),
+                           ('dirty', session.dirty),
+                           ('deleted', session.deleted)):
+        span.set_tag('sqlalchemy.flush.' + state, len(objects))
+        counts = {}
+        for obj in objects:
+            mapper = object_mapper(obj)
+            counts[mapper] = counts.get(mapper, 0) + 1
+        for mapper, count in counts.items():
+            cls = mapper.class_
+            span.set_tag('sqlalchemy.flush.%s.%s.%s' % (state, cls.__module__,
+                                                        cls.__qualname__),
+                         count)
+
+    session.info[FLUSH_SPAN_KEY] = (span, flush_context)
+
+def _session_after_flush_handler(session, flush_context):
+    _finish_flush_span(session, failed=False)
+
+def _session_flush_rollback_handler(session, previous_transaction):
+    # A failed flush rolls back its own transaction, while
+    # other rollbacks only end a flush with nothing to write.
+    entry = session.info.get(FLUSH_SPAN_KEY)
+    if entry is not None:
+        flush_transaction = getattr(entry[1], 'transaction', None)
+        _finish_flush_span(session,
+                           failed=flush_transaction is previous_transaction)
+
+def _session_commit_handler(session):
+    _finish_flush_span(session, failed=False)
+
+def _finish_flush_span(session, failed):
+    entry = session.info.pop(FLUSH_SPAN_KEY, None)
+    if entry is None:
+        return
+
+    span = entry[0]
+    if failed:
+        span.set_tag('error', 'true')
+    span.finish()
+
+def _get_flush_span(conn):
+    session_ref = g_flush_sessions.get(conn)
+    session = session_ref() if session_ref is not None else None
+    if session is None:
+        return None
+
+    entry = session.info.get(FLUSH_SPAN_KEY)
+    if entry is None:
+        return None
+
+    # The flush transaction begins only when there is something
+    # to write, right before executing the statements.
+    if getattr(entry[1], 'transaction', None) is None:
+        return None
+
+    return entry[0]
+
+g_flush_handlers = (
+    ('after_begin', _session_begin_handler),
+    ('before_flush', _session_before_flush_handler),
+    ('after_flush_postexec', _session_after_flush_handler),
+    ('after_soft_rollback', _session_flush_rollback_handler),
+    ('after_commit', _session_commit_handler),
+)
+
+def _reinit_after_fork():
+    # Spans in progress belong to the parent process. Statistics
+    # and reporters get reset by their own modules.
+    g_current_span.set(None)
+    g_flush_sessions.clear()
+    g_execute_start_time.set(None)
+    g_transactions.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
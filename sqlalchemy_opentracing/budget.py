@@ -0,0 +1,55 @@
+'''
+Query budgets, capping the number of queries and the time
+spent on them under a parent span or Session.
+'''
+
+ACTION_TAG = 'tag'
+ACTION_WARN = 'warn'
+ACTION_RAISE = 'raise'
+
+ACTIONS = (ACTION_TAG, ACTION_WARN, ACTION_RAISE)
+
+class QueryBudgetExceeded(Exception):
+    '''
+    Raised by queries exceeding a budget with the 'raise' action.
+    '''
+    def __init__(self, message, budget):
+        super(QueryBudgetExceeded, self).__init__(message)
+        self.budget = budget
+
+class QueryBudget(object):
+    '''
+    Maximum number of queries and total time (in seconds) spent
+    executing them, along with the current usage. Either limit
+    can be None, meaning no limit.
+
+    Once exceeded, the spans of the offending queries are tagged,
+    and, depending on action, a warning is logged (only the first
+    time) or QueryBudgetExceeded is raised.
+    '''
+    def __init__(self, max_queries=None, max_db_time=None, action=ACTION_TAG):
+        super(QueryBudget, self).__init__()
+        if action not in ACTIONS:
+            raise ValueError('action must be one of %s' % ', '.join(ACTIONS))
+
+        self.max_queries = max_queries
+        self.max_db_time = max_db_time
+        self.action = action
+        self.queries = 0
+        self.db_time = 0.0
+        self.exceeded = False
+
+    def add_query(self):
+        '''
+        Account a query, returning whether it exceeds the budget.
+        '''
+        self.queries += 1
+        return self.max_queries is not None and self.queries > self.max_queries
+
+    def add_db_time(self, duration):
+        '''
+        Account the time spent on a query, returning
+        whether it exceeds the budget.
+        '''
+        self.db_time += duration
+        return self.max_db_time is not None and self.db_time > self.max_db_time
@@ -0,0 +1,99 @@
+'''
+Tracing configuration, which can be bound to individual engines.
+'''
+import random
+
+class TracingConfig(object):
+    '''
+    Tracer, query selection and sampling settings for the engines it
+    is bound to through register_engine(), or for all the other ones,
+    when set through init_tracing(). Tracer objects from our
+    pyramid/flask/django libraries can be passed as well.
+
+    tags are extra static tags for all the spans (along with the peer
+    ones of the engine URL, if any), and statement_filter,
+    if any, is called with the SQL of every query about to be traced,
+    skipping it if False is returned.
+
+    The rest of the options control how each query is reported,
+    as described in init_tracing(). query_stats and query_recorder
+    can be used with a tracer being None.
+    '''
+    def __init__(self, tracer, trace_all_queries=True, sample_rate=1.0,
+                 operation_sample_rates=None, tags=None,
+                 statement_filter=None, slow_query_threshold=None,
+                 max_statement_length=None, fingerprint_statements=False,
+                 query_stats=None, trace_fetch=False,
+                 n_plus_one_threshold=None, n_plus_one_callback=None,
+                 trace_compilation=False, trace_transactions=False,
+                 query_recorder=None):
+        super(TracingConfig, self).__init__()
+        if hasattr(tracer, '_tracer'):
+            tracer = tracer._tracer
+
+        operation_sample_rates = dict(operation_sample_rates or {})
+        rates = [sample_rate] + list(operation_sample_rates.values())
+        for rate in rates:
+            if not 0.0 <= rate <= 1.0:
+                raise ValueError('Sample rates must be between 0.0 and 1.0')
+
+        self.tracer = tracer
+        self.trace_all_queries = trace_all_queries
+        self.sample_rate = sample_rate
+        self.operation_sample_rates = operation_sample_rates
+        self.sampling = any(rate < 1.0 for rate in rates)
+        self.tags = dict(tags or {})
+        self.statement_filter = statement_filter
+        self.slow_query_threshold = slow_query_threshold
+        self.max_statement_length = max_statement_length
+        self.fingerprint_statements = fingerprint_statements
+        self.query_stats = query_stats
+        self.query_recorder = query_recorder
+        self.recording = query_stats is not None or query_recorder is not None
+        self.trace_fetch = trace_fetch
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.n_plus_one_callback = n_plus_one_callback
+        self.trace_compilation = trace_compilation
+        self.trace_transactions = trace_transactions
+
+    def is_sampled(self, name):
+        '''
+        Get whether a query with the given operation name
+        is picked by the head-based sampling.
+        '''
+        rate = self.operation_sample_rates.get(name, self.sample_rate)
+        return rate >= 1.0 or random.random() < rate
+
+    def get_static_tags(self, engine):
+        '''
+        Gets the tags shared by all the spans of an engine,
+        as a tuple of (key, value) pairs.
+        '''
+        tags = [
+            ('component', 'sqlalchemy'),
+            ('db.type', 'sql'),
+            ('sqlalchemy.dialect', engine.dialect.name),
+        ]
+        tags.extend(get_peer_tags(engine.url))
+        tags.extend(self.tags.items())
+        return tuple(tags)
+
+def get_peer_tags(url):
+    '''
+    Gets the peer.hostname, peer.port, db.instance and db.user
+    tags of a database URL, as a list of (key, value) pairs.
+    Only databases accessed over the network (that is,
+    with a host) get them.
+    '''
+    if not url.host:
+        return []
+
+    tags = [('peer.hostname', url.host)]
+    if url.port is not None:
+        tags.append(('peer.port', url.port))
+    if url.database:
+        tags.append(('db.instance', url.database))
+    if url.username:
+        tags.append(('db.user', url.username))
+
+    return tags
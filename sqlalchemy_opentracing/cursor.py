@@ -0,0 +1,104 @@
+'''
+DBAPI cursor proxy keeping a query span open till
+its results are fetched, and the cursor closed.
+'''
+import time
+
+class TracedCursor(object):
+    '''
+    Wraps a DBAPI cursor, timing the fetch calls and counting the
+    fetched rows, and finishing span (with such information as tags)
+    once the cursor is closed - that is, when its result
+    gets exhausted or closed.
+
+    For streamed results, the number of fetched batches, the rows
+    per batch and the time to the first row, since start_time,
+    are reported as well.
+    '''
+    def __init__(self, cursor, span, start_time, execute_time,
+                 streaming=False):
+        super(TracedCursor, self).__init__()
+        self._cursor = cursor
+        self._span = span
+        self._start_time = start_time
+        self._execute_time = execute_time
+        self._streaming = streaming
+        self._fetch_time = 0.0
+        self._first_row_time = None
+        self._rows = 0
+        self._batches = 0
+        self._max_batch_rows = 0
+        self._finished = False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def fetchone(self):
+        start_time = time.monotonic()
+        row = self._cursor.fetchone()
+        self._account_batch(start_time, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args):
+        start_time = time.monotonic()
+        rows = self._cursor.fetchmany(*args)
+        self._account_batch(start_time, len(rows))
+        return rows
+
+    def fetchall(self):
+        start_time = time.monotonic()
+        rows = self._cursor.fetchall()
+        self._account_batch(start_time, len(rows))
+        return rows
+
+    def _account_batch(self, start_time, nrows):
+        now = time.monotonic()
+        self._fetch_time += now - start_time
+        if nrows == 0:
+            return
+
+        if self._first_row_time is None:
+            self._first_row_time = now
+
+        self._rows += nrows
+        self._batches += 1
+        if nrows > self._max_batch_rows:
+            self._max_batch_rows = nrows
+
+    def close(self):
+        try:
+            self._cursor.close()
+        finally:
+            self.finish_span()
+
+    def finish_span(self):
+        '''
+        Tag and finish the span, if not done already.
+        '''
+        if self._finished:
+            return
+
+        self._finished = True
+        span = self._span
+        span.set_tag('sqlalchemy.execute_time', self._execute_time)
+        span.set_tag('sqlalchemy.fetch_time', self._fetch_time)
+        span.set_tag('db.rows_fetched', self._rows)
+
+        rowcount = getattr(self._cursor, 'rowcount', -1)
+        if rowcount is not None and rowcount >= 0:
+            span.set_tag('db.rowcount', rowcount)
+
+        if self._streaming:
+            span.set_tag('sqlalchemy.stream_results', True)
+            span.set_tag('db.fetch_batches', self._batches)
+            if self._batches > 0:
+                span.set_tag('db.rows_per_batch', float(self._rows) / self._batches)
+                span.set_tag('db.rows_per_batch.max', self._max_batch_rows)
+            if self._first_row_time is not None:
+                span.set_tag('db.time_to_first_row',
+                             self._first_row_time - self._start_time)
+
+        span.finish()
@@ -0,0 +1,62 @@
+'''
+Statement fingerprinting, turning SQL statements into
+their literal-free shape, so queries can be grouped together.
+'''
+import hashlib
+import re
+from functools import lru_cache
+
+CACHE_SIZE = 1024
+CACHE_MAX_LENGTH = 4096
+
+# Literals and comments are matched in a single pass, so that
+# neither one is looked for inside the other, with bind
+# parameters taking precedence over numbers (as in '$1').
+_TOKEN_RE = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<param>%\(\w+\)s|%s|(?<!:):\w+|\$\d+)
+  | (?P<number>(?<![\w.$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b)
+""", re.DOTALL | re.VERBOSE)
+_LIST_RE = re.compile(r'\b(IN)\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def _replace_token(match):
+    if match.lastgroup == 'comment':
+        return ' '
+    return '?'
+
+def _fingerprint_uncached(statement):
+    # Have every dialect's bind parameters look the same, as well
+    # as literals, and collapse IN lists of them, as in 'IN (?, ?)'.
+    text = _TOKEN_RE.sub(_replace_token, statement)
+    text = _LIST_RE.sub(r'\1 (?+)', text)
+    text = _WHITESPACE_RE.sub(' ', text).strip()
+
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+    return text, digest
+
+_fingerprint_cached = lru_cache(maxsize=CACHE_SIZE)(_fingerprint_uncached)
+
+def get_fingerprint(statement):
+    '''
+    Gets a (fingerprint, hash) tuple for a statement: its
+    literal-free, whitespace-collapsed form, along with a short,
+    stable hash of it. Results are memoized per statement.
+    '''
+    if len(statement) > CACHE_MAX_LENGTH:
+        return _fingerprint_uncached(statement)
+
+    return _fingerprint_cached(statement)
+
+def cache_info():
+    '''
+    Gets the statistics of the fingerprints cache.
+    '''
+    return _fingerprint_cached.cache_info()
+
+def clear_cache():
+    '''
+    Clear the fingerprints cache.
+    '''
+    _fingerprint_cached.cache_clear()
@@ -0,0 +1,180 @@
+'''
+Connection pool instrumentation, reporting checkout wait time,
+pool usage and connection age as tags of the query spans.
+'''
+import contextvars
+import time
+import weakref
+
+from sqlalchemy.event import listen
+
+POOL_TAGS_KEY = 'sqlalchemy_opentracing.pool_tags'
+CONNECT_TIME_KEY = 'sqlalchemy_opentracing.connect_time'
+
+# Engine -> PoolInstrumentation
+g_instrumented = weakref.WeakKeyDictionary()
+
+# Engine -> PoolInstrumentation, kept once uninstrumented, as the
+# listeners copied to the pools recreated by Engine.dispose()
+# can't be removed, and are reused if instrumented again.
+g_instrumentations = weakref.WeakKeyDictionary()
+
+# Set right before the checkout event of the same thread/asyncio task.
+g_checkout_wait_time = contextvars.ContextVar('sqlalchemy_opentracing_checkout_wait_time',
+                                              default=None)
+
+POOL_EVENTS = ('connect', 'checkout', 'checkin', 'invalidate')
+
+class PoolInstrumentation(object):
+    '''
+    Instrumentation of the pool of an engine, which is moved
+    to the new pool when the engine gets disposed. Its listeners
+    are registered only once per engine, doing nothing while
+    the instrumentation is detached or tracing is disabled
+    for the engine, as told by is_enabled(engine).
+    '''
+    def __init__(self, engine):
+        super(PoolInstrumentation, self).__init__()
+        self.invalidations = 0
+        self.attached = False
+        self._engine_ref = weakref.ref(engine)
+        self._is_enabled = None
+        self._pool_ref = None
+        self._listened_pool_ref = None
+        self._listeners = dict((event, getattr(self, event + '_handler'))
+                               for event in POOL_EVENTS + ('engine_disposed',))
+
+        listen(engine, 'engine_disposed', self._listeners['engine_disposed'])
+
+    def attach(self, engine, is_enabled):
+        self.invalidations = 0
+        self.attached = True
+        self._is_enabled = is_enabled
+        self._wrap_pool(engine.pool)
+
+        listened_pool = self._listened_pool_ref() \
+            if self._listened_pool_ref is not None else None
+        if listened_pool is not engine.pool:
+            self._listened_pool_ref = weakref.ref(engine.pool)
+            for event in POOL_EVENTS:
+                listen(engine.pool, event, self._listeners[event])
+
+    def detach(self, engine):
+        self.attached = False
+
+        pool = self._pool_ref()
+        self._pool_ref = None
+        if pool is not None:
+            del pool._do_get
+
+    def is_active(self):
+        '''
+        Get whether the instrumentation is attached,
+        with tracing being enabled for its engine.
+        '''
+        if not self.attached:
+            return False
+
+        engine = self._engine_ref()
+        return engine is not None and self._is_enabled(engine)
+
+    def _wrap_pool(self, pool):
+        self._pool_ref = weakref.ref(pool)
+
+        # There's no event for the moment a checkout starts,
+        # so wrap the method actually getting a connection.
+        do_get = pool._do_get
+        def _do_get():
+            if not self.is_active():
+                return do_get()
+
+            start_time = time.monotonic()
+            record = do_get()
+            g_checkout_wait_time.set(time.monotonic() - start_time)
+            return record
+
+        pool._do_get = _do_get
+
+    def checkout_handler(self, dbapi_connection, connection_record,
+                         connection_proxy):
+        wait_time = g_checkout_wait_time.get()
+        if wait_time is None:
+            return
+
+        g_checkout_wait_time.set(None)
+        if not self.is_active():
+            return
+
+        pool = self._pool_ref()
+        if pool is None:
+            return
+
+        tags = {
+            'db.pool.checkout_wait': wait_time,
+            'db.pool.invalidations': self.invalidations,
+        }
+        connect_time = connection_record.info.get(CONNECT_TIME_KEY)
+        if connect_time is not None:
+            tags['db.pool.connection_age'] = time.monotonic() - connect_time
+        elif getattr(connection_record, 'starttime', None) is not None:
+            # Connected before the pool got instrumented.
+            tags['db.pool.connection_age'] = time.time() - connection_record.starttime
+
+        # Not all the pool classes keep track of these.
+        for tag, method in (('db.pool.size', 'size'),
+                            ('db.pool.checked_out', 'checkedout'),
+                            ('db.pool.overflow', 'overflow')):
+            if hasattr(pool, method):
+                tags[tag] = getattr(pool, method)()
+
+        connection_record.info[POOL_TAGS_KEY] = tags
+
+    def engine_disposed_handler(self, engine):
+        # SQLAlchemy copies the listeners of the previous
+        # pool over, so they are not registered again.
+        self._listened_pool_ref = weakref.ref(engine.pool)
+        if self.attached:
+            self._wrap_pool(engine.pool)
+
+    def connect_handler(self, dbapi_connection, connection_record):
+        if self.is_active():
+            connection_record.info[CONNECT_TIME_KEY] = time.monotonic()
+
+    def checkin_handler(self, dbapi_connection, connection_record):
+        if connection_record is not None:
+            connection_record.info.pop(POOL_TAGS_KEY, None)
+
+    def invalidate_handler(self, dbapi_connection, connection_record, exception):
+        if self.attached:
+            self.invalidations += 1
+
+def instrument_engine_pool(engine, is_enabled):
+    '''
+    Instrument the pool of an engine, if not done already,
+    while is_enabled(engine) returns True.
+    '''
+    if engine in g_instrumented:
+        return
+
+    instrumentation = g_instrumentations.get(engine)
+    if instrumentation is None:
+        instrumentation = PoolInstrumentation(engine)
+        g_instrumentations[engine] = instrumentation
+
+    instrumentation.attach(engine, is_enabled)
+    g_instrumented[engine] = instrumentation
+
+def uninstrument_engine_pool(engine):
+    '''
+    Remove the instrumentation of the pool of an engine, if any.
+    '''
+    instrumentation = g_instrumented.pop(engine, None)
+    if instrumentation is not None:
+        instrumentation.detach(engine)
+
+def pop_pool_tags(conn):
+    '''
+    Gets the tags of the last checkout of a connection,
+    if not consumed already.
+    '''
+    return conn.info.pop(POOL_TAGS_KEY, None)
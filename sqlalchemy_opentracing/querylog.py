@@ -0,0 +1,213 @@
+'''
+Query log kept in a fixed-size, memory-mapped ring buffer file,
+so the latest queries can be inspected after an incident
+(or a crash), without any tracing backend.
+
+The file starts with a header (magic, format version, record size
+and capacity), followed by capacity fixed-size slots, each holding
+a record along with its sequence number (with 0 for unused slots).
+Records are only written to the mapped pages, and the OS persists
+them even if the process dies.
+'''
+import itertools
+import logging
+import mmap
+import os
+import struct
+import weakref
+
+from .records import QueryRecord
+
+MAGIC = b'SQLAQLOG'
+VERSION = 1
+
+# magic, version, record size, capacity.
+HEADER = struct.Struct('<8sHHI')
+HEADER_SIZE = 32
+
+# sequence, timestamp, duration, fingerprint hash,
+# error flag, operation name, dialect name.
+RECORD = struct.Struct('<QddQ?23s16s')
+RECORD_SIZE = RECORD.size
+
+_pack_record = RECORD.pack_into
+
+# Fingerprint hashes are converted to integers once, up to this
+# number of distinct ones at a time.
+FINGERPRINTS_CACHE_SIZE = 4096
+
+_instances = weakref.WeakSet()
+
+logger = logging.getLogger(__name__)
+
+class QueryLogWriter(object):
+    '''
+    Writes the records of a query_recorder (see init_tracing())
+    into the ring buffer file at path, keeping the last capacity
+    ones. Writing a record packs it straight into its slot.
+
+    An existing query log file is appended to, unless its capacity
+    or format differs, in which case it gets overwritten. path can
+    include a {pid} placeholder, for a log per process; otherwise,
+    forked processes don't write to the log of their parent.
+    '''
+    def __init__(self, path, capacity=100000):
+        super(QueryLogWriter, self).__init__()
+        if capacity < 1:
+            raise ValueError('capacity must be a positive integer')
+
+        self.path_template = path
+        self.capacity = capacity
+        self._names = {}
+        self._fingerprints = {}
+        self._open()
+        _instances.add(self)
+
+    def _open(self):
+        self.path = self.path_template.format(pid=os.getpid())
+        size = HEADER_SIZE + self.capacity * RECORD_SIZE
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.read(fd, HEADER.size)
+            if header and header[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not a query log file: %s' % self.path)
+
+            reuse = (len(header) == HEADER.size and
+                     HEADER.unpack(header)[1:] == (VERSION, RECORD_SIZE, self.capacity) and
+                     os.fstat(fd).st_size == size)
+            if not reuse:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD_SIZE, self.capacity)
+        last_sequence = 0
+        if reuse:
+            last_sequence = max(_iter_sequences(self._mmap, self.capacity))
+
+        # next() on a count is atomic, so concurrent writers
+        # never get the same slot.
+        self._sequence = itertools.count(last_sequence + 1)
+
+    def _encode(self, name):
+        encoded = self._names[name] = name.encode('utf-8')
+        return encoded
+
+    def _fingerprint_id(self, fingerprint):
+        if len(self._fingerprints) >= FINGERPRINTS_CACHE_SIZE:
+            self._fingerprints.clear()
+
+        value = self._fingerprints[fingerprint] = int(fingerprint, 16)
+        return value
+
+    def record(self, record):
+        buf = self._mmap
+        if buf is None:
+            return
+
+        # Operation and dialect names are a few, shared strings.
+        names = self._names
+        operation = names.get(record.operation) or self._encode(record.operation)
+        dialect = names.get(record.dialect) or self._encode(record.dialect)
+        fingerprint = self._fingerprints.get(record.fingerprint)
+        if fingerprint is None:
+            fingerprint = self._fingerprint_id(record.fingerprint)
+
+        sequence = next(self._sequence)
+        _pack_record(buf, HEADER_SIZE + (sequence % self.capacity) * RECORD_SIZE,
+                     sequence, record.timestamp, record.duration,
+                     fingerprint, record.error,
+                     operation, dialect)
+
+    def flush(self):
+        '''
+        Have the written records be synced to disk.
+        '''
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+    def _reinit_after_fork(self):
+        if self._mmap is None:
+            return
+
+        # The mapping is shared with the parent process, with each
+        # one having its own sequence, so only a log of our own
+        # can be written to.
+        if self.path_template.format(pid=os.getpid()) == self.path:
+            logger.warning('Not writing to the query log %s from a forked process',
+                           self.path)
+            self._mmap = None
+        else:
+            self._open()
+
+class QueryLogReader(object):
+    '''
+    Reads the records of a query log file, possibly being written
+    by another process. Iterating it yields records.QueryRecord
+    objects, oldest first, taken from a snapshot of the file.
+    '''
+    def __init__(self, path):
+        super(QueryLogReader, self).__init__()
+        self.path = path
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if len(data) < HEADER_SIZE:
+            raise ValueError('Not a query log file: %s' % path)
+
+        magic, version, record_size, capacity = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a query log file: %s' % path)
+        if version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError('Unsupported query log version: %s' % version)
+
+        self.capacity = capacity
+        self._data = data
+
+    def __len__(self):
+        return sum(1 for sequence in _iter_sequences(self._data, self.capacity)
+                   if sequence != 0)
+
+    def __iter__(self):
+        data = self._data
+        entries = []
+        for index in range(self.capacity):
+            entry = RECORD.unpack_from(data, HEADER_SIZE + index * RECORD_SIZE)
+            if entry[0] != 0:
+                entries.append(entry)
+
+        entries.sort(key=lambda entry: entry[0])
+        for (sequence, timestamp, duration, fingerprint,
+             error, operation, dialect) in entries:
+            yield QueryRecord(timestamp, duration,
+                              operation.rstrip(b'\0').decode('utf-8', 'replace'),
+                              dialect.rstrip(b'\0').decode('utf-8', 'replace'),
+                              '%016x' % fingerprint, error)
+
+def read_query_log(path):
+    '''
+    Gets the records of a query log file, oldest first.
+    '''
+    return list(QueryLogReader(path))
+
+def _iter_sequences(buf, capacity):
+    for index in range(capacity):
+        yield struct.unpack_from('<Q', buf, HEADER_SIZE + index * RECORD_SIZE)[0]
+
+def _reinit_writers_after_fork():
+    for writer in list(_instances):
+        writer._reinit_after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_writers_after_fork)
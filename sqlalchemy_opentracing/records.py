@@ -0,0 +1,83 @@
+'''
+Compact records of executed queries, for buffering or exporting
+them without holding full span objects in memory.
+'''
+import collections
+import os
+import sys
+import threading
+import weakref
+
+_instances = weakref.WeakSet()
+
+class QueryRecord(object):
+    '''
+    A single executed query: its start timestamp (in seconds since
+    the epoch), duration (in seconds), operation name, dialect name,
+    statement fingerprint hash and whether it failed.
+
+    Names and fingerprints are interned strings, so records
+    only hold references to them rather than copies.
+    '''
+    __slots__ = ('timestamp', 'duration', 'operation', 'dialect',
+                 'fingerprint', 'error')
+
+    def __init__(self, timestamp, duration, operation, dialect,
+                 fingerprint, error=False):
+        self.timestamp = timestamp
+        self.duration = duration
+        self.operation = operation
+        self.dialect = dialect
+        self.fingerprint = sys.intern(fingerprint)
+        self.error = error
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'operation': self.operation,
+            'dialect': self.dialect,
+            'fingerprint': self.fingerprint,
+            'error': self.error,
+        }
+
+class QueryRecordBuffer(object):
+    '''
+    Keeps the last max_records query records in memory,
+    till they are drained.
+    '''
+    def __init__(self, max_records=100000):
+        super(QueryRecordBuffer, self).__init__()
+        self._lock = threading.Lock()
+        self._records = collections.deque(maxlen=max_records)
+        _instances.add(self)
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, record):
+        # Appending to a deque being swapped by drain() would lose it.
+        with self._lock:
+            self._records.append(record)
+
+    def drain(self):
+        '''
+        Gets the buffered records, oldest first, and clear them.
+        '''
+        with self._lock:
+            records = self._records
+            self._records = collections.deque(maxlen=records.maxlen)
+
+        return list(records)
+
+    def _reinit_after_fork(self):
+        # Records so far are drained by the parent process.
+        self._lock = threading.Lock()
+        self._records = collections.deque(maxlen=self._records.maxlen)
+
+def _reinit_buffers_after_fork():
+    for buf in list(_instances):
+        buf._reinit_after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_buffers_after_fork)
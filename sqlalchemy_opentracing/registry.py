@@ -0,0 +1,87 @@
+'''
+Tracing state for statements, connections and sessions,
+kept outside of the objects themselves.
+'''
+import weakref
+
+_UNSET = object()
+
+class TracingState(object):
+    '''
+    Tracing information of a single object.
+    '''
+    __slots__ = ('parent_span', 'session_state', 'query_counts', 'budget',
+                 'transactions')
+
+    def __init__(self):
+        self.parent_span = _UNSET
+        self.session_state = None
+        self.query_counts = None
+        self.budget = None
+        self.transactions = None
+
+    def has_parent_span(self):
+        return self.parent_span is not _UNSET
+
+    def get_parent_span(self):
+        if self.parent_span is _UNSET:
+            return None
+
+        return self.parent_span
+
+class TracingRegistry(object):
+    '''
+    Maps objects to their TracingState, keyed by identity - statements
+    overload the comparison operators - and holding them only through
+    weak references, so entries (and the spans they reference) are
+    released as soon as their object is garbage collected.
+    '''
+    def __init__(self):
+        super(TracingRegistry, self).__init__()
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, obj):
+        '''
+        Gets the tracing state of an object, or None.
+        '''
+        entry = self._entries.get(id(obj))
+        if entry is None or entry[0]() is not obj:
+            return None
+
+        return entry[1]
+
+    def setdefault(self, obj):
+        '''
+        Gets the tracing state of an object,
+        creating it if it didn't exist.
+        '''
+        state = self.get(obj)
+        if state is None:
+            key = id(obj)
+            state = TracingState()
+            ref = weakref.ref(obj, lambda ref: self._remove(key, ref))
+            self._entries[key] = (ref, state)
+
+        return state
+
+    def pop(self, obj):
+        '''
+        Remove the tracing state of an object, returning it, if any.
+        '''
+        state = self.get(obj)
+        if state is not None:
+            self._entries.pop(id(obj), None)
+
+        return state
+
+    def clear(self):
+        self._entries.clear()
+
+    def _remove(self, key, ref):
+        # The id may have been reused by a newer object already.
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is ref:
+            del self._entries[key]
@@ -0,0 +1,193 @@
+'''
+Asynchronous span reporting, so the actual tracer work happens
+in a background thread instead of the thread running the queries.
+'''
+import atexit
+import collections
+import logging
+import os
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+_reporters = weakref.WeakSet()
+
+class AsyncFinishTracer(object):
+    '''
+    Tracer wrapper recording spans data in memory, which is later
+    handed to the actual tracer from a background thread, every
+    flush_interval seconds. Finishing a span only appends it to a
+    bounded queue, with spans being dropped (and counted in
+    the dropped attribute) if it is full.
+
+    Spans created through this object can only have other spans
+    created through it, or actual spans, as parents. references
+    are handed to the actual tracer as they are. Getting the
+    context of a span has it created by the actual tracer right
+    away, from the current thread, so it can be propagated.
+    '''
+    def __init__(self, tracer, max_queue_size=10000, flush_interval=0.5):
+        super(AsyncFinishTracer, self).__init__()
+        self.tracer = tracer
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+
+        self._queue = collections.deque()
+        self._drain_lock = threading.Lock()
+        self._realize_lock = threading.RLock()
+        self._thread_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        _reporters.add(self)
+
+    def start_span(self, operation_name=None, child_of=None,
+                   references=None, tags=None, start_time=None):
+        if self._thread is None:
+            self._start_thread()
+
+        return _DeferredSpan(self, operation_name, child_of, references, tags,
+                             start_time if start_time is not None else time.time())
+
+    def flush(self):
+        '''
+        Report all the finished spans to the actual
+        tracer, from the current thread.
+        '''
+        with self._drain_lock:
+            while self._queue:
+                self._emit(self._queue.popleft())
+
+    def close(self):
+        '''
+        Stop the background thread and report
+        any pending spans.
+        '''
+        with self._thread_lock:
+            thread = self._thread
+            if thread is not None:
+                self._stop_event.set()
+                thread.join()
+                self._thread = None
+                self._stop_event.clear()
+
+        self.flush()
+
+    def _report(self, span):
+        if len(self._queue) >= self.max_queue_size:
+            with self._thread_lock:
+                self.dropped += 1
+            return
+
+        self._queue.append(span)
+
+    def _start_thread(self):
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run,
+                                            name='sqlalchemy_opentracing-reporter')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _reinit_after_fork(self):
+        # Only the forking thread survives, and pending
+        # spans are left for the parent process to report.
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._drain_lock = threading.Lock()
+        self._realize_lock = threading.RLock()
+        self._thread_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def _realize(self, deferred):
+        # Parents are finished (and thus reported) after their
+        # children, so create them as soon as they are needed.
+        # Contexts can be asked for from any thread.
+        with self._realize_lock:
+            if deferred._span is None:
+                parent = deferred.child_of
+                if isinstance(parent, _DeferredSpan):
+                    parent = self._realize(parent)
+
+                deferred._span = self.tracer.start_span(
+                    operation_name=deferred.operation_name,
+                    child_of=parent,
+                    references=deferred.references,
+                    start_time=deferred.start_time)
+
+            return deferred._span
+
+    def _emit(self, deferred):
+        try:
+            span = self._realize(deferred)
+            for key, value in deferred.tags.items():
+                span.set_tag(key, value)
+            for key_values, timestamp in deferred.logs:
+                span.log_kv(key_values, timestamp)
+
+            span.finish(finish_time=deferred.finish_time)
+        except Exception:
+            logger.exception('Failed to report span %s', deferred.operation_name)
+
+class _DeferredSpan(object):
+    '''
+    Span data, handed to the actual tracer once finished.
+    '''
+    def __init__(self, tracer, operation_name, child_of, references,
+                 tags, start_time):
+        super(_DeferredSpan, self).__init__()
+        self._tracer = tracer
+        self._span = None
+        self.operation_name = operation_name
+        self.child_of = child_of
+        self.references = references
+        self.tags = dict(tags or {})
+        self.logs = []
+        self.start_time = start_time
+        self.finish_time = None
+
+    @property
+    def tracer(self):
+        return self._tracer
+
+    @property
+    def context(self):
+        return self._tracer._realize(self).context
+
+    def set_operation_name(self, operation_name):
+        self.operation_name = operation_name
+        return self
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+        return self
+
+    def log_kv(self, key_values, timestamp=None):
+        self.logs.append((key_values, timestamp or time.time()))
+        return self
+
+    def finish(self, finish_time=None):
+        self.finish_time = finish_time if finish_time is not None else time.time()
+        self._tracer._report(self)
+
+@atexit.register
+def _close_reporters():
+    for reporter in list(_reporters):
+        reporter.close()
+
+def _reinit_reporters_after_fork():
+    for reporter in list(_reporters):
+        reporter._reinit_after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_reporters_after_fork)
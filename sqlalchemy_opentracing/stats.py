@@ -0,0 +1,160 @@
+'''
+In-process query statistics, aggregated per operation
+and statement fingerprint, for when reporting a span
+per query is too expensive.
+'''
+import bisect
+import os
+import threading
+import weakref
+
+# Upper bounds (in seconds) of the latency histogram buckets,
+# with a last, implicit one for anything slower.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Key used for queries once max_keys distinct ones are being tracked.
+OVERFLOW_KEY = ('overflow', None)
+
+# Statistics objects, reset in forked processes.
+_instances = weakref.WeakSet()
+
+class _QueryStatsEntry(object):
+    __slots__ = ('statement', 'count', 'total_time', 'errors', 'histogram')
+
+    def __init__(self, statement, nbuckets):
+        self.statement = statement
+        self.count = 0
+        self.total_time = 0.0
+        self.errors = 0
+        self.histogram = [0] * nbuckets
+
+    def to_dict(self):
+        return {
+            'statement': self.statement,
+            'count': self.count,
+            'total_time': self.total_time,
+            'errors': self.errors,
+            'histogram': list(self.histogram),
+        }
+
+class QueryStats(object):
+    '''
+    Aggregates count, total time, error count and a latency
+    histogram per (operation name, fingerprint hash) key.
+    At most max_keys distinct keys are tracked, with further
+    queries being accounted under OVERFLOW_KEY.
+    '''
+    def __init__(self, max_keys=1000, buckets=DEFAULT_BUCKETS):
+        super(QueryStats, self).__init__()
+        if max_keys < 1:
+            raise ValueError('max_keys must be at least 1')
+
+        self.max_keys = max_keys
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        _instances.add(self)
+
+    def record(self, operation, fingerprint, duration, error=False):
+        '''
+        Account a query, being fingerprint a (fingerprint, hash) tuple,
+        as returned by fingerprint.get_fingerprint().
+        '''
+        key = (operation, fingerprint[1])
+        bucket = bisect.bisect_left(self.buckets, duration)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._add_entry(key, fingerprint[0])
+
+            entry.count += 1
+            entry.total_time += duration
+            entry.histogram[bucket] += 1
+            if error:
+                entry.errors += 1
+
+    def _add_entry(self, key, statement):
+        # Overflow entry doesn't count against the limit.
+        if len(self._entries) - (OVERFLOW_KEY in self._entries) >= self.max_keys:
+            key = OVERFLOW_KEY
+            statement = None
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+
+        entry = _QueryStatsEntry(statement, len(self.buckets) + 1)
+        self._entries[key] = entry
+        return entry
+
+    def snapshot(self, reset=False):
+        '''
+        Gets the current statistics, as a dictionary from
+        (operation name, fingerprint hash) to a dictionary of
+        statement, count, total_time, errors and histogram,
+        optionally resetting them afterwards.
+        '''
+        with self._lock:
+            entries = self._entries
+            if reset:
+                self._entries = {}
+
+            return dict((key, entry.to_dict()) for key, entry in entries.items())
+
+    def reset(self):
+        '''
+        Clear the current statistics.
+        '''
+        with self._lock:
+            self._entries = {}
+
+    def _reinit_after_fork(self):
+        # Statistics so far are reported by the parent process.
+        self._lock = threading.Lock()
+        self._entries = {}
+
+class CompiledCacheStats(object):
+    '''
+    Counts of the executed statements per SQLAlchemy compiled cache
+    status, such as 'hit' or 'miss'.
+    '''
+    def __init__(self):
+        super(CompiledCacheStats, self).__init__()
+        self._lock = threading.Lock()
+        self._counts = {}
+
+        _instances.add(self)
+
+    def record(self, status):
+        with self._lock:
+            self._counts[status] = self._counts.get(status, 0) + 1
+
+    def snapshot(self, reset=False):
+        '''
+        Gets the counts per status, along with the hit ratio
+        (hits over hits and misses, or None if there were none)
+        as 'hit_ratio', optionally resetting them afterwards.
+        '''
+        with self._lock:
+            counts = self._counts
+            if reset:
+                self._counts = {}
+            else:
+                counts = dict(counts)
+
+        lookups = counts.get('hit', 0) + counts.get('miss', 0)
+        counts['hit_ratio'] = float(counts.get('hit', 0)) / lookups if lookups else None
+        return counts
+
+    def _reinit_after_fork(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+def _reinit_stats_after_fork():
+    for stats in list(_instances):
+        stats._reinit_after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_stats_after_fork)
@@ -0,0 +1,93 @@
+'''
+Transaction and savepoint spans accounting, tracking
+the statements executed under them and the time they
+spend idle in between.
+'''
+import time
+
+OUTCOME_COMMIT = 'commit'
+OUTCOME_ROLLBACK = 'rollback'
+OUTCOME_RELEASE = 'release'
+
+class _TransactionSpan(object):
+    __slots__ = ('span', 'savepoint', 'statements', 'idle_time', 'idle_since')
+
+    def __init__(self, span, savepoint, now):
+        self.span = span
+        self.savepoint = savepoint
+        self.statements = 0
+        self.idle_time = 0.0
+        self.idle_since = now
+
+    def finish(self, outcome, now):
+        if self.idle_since is not None:
+            self.idle_time += now - self.idle_since
+
+        span = self.span
+        span.set_tag('sqlalchemy.transaction.outcome', outcome)
+        span.set_tag('sqlalchemy.transaction.statements', self.statements)
+        span.set_tag('sqlalchemy.transaction.idle_time', self.idle_time)
+        if self.savepoint is not None:
+            span.set_tag('sqlalchemy.savepoint', self.savepoint)
+        span.finish()
+
+class TransactionSpans(object):
+    '''
+    Open spans of the transaction of a connection, and of its
+    savepoints, with statements accounted for all of them.
+    '''
+    def __init__(self, span):
+        super(TransactionSpans, self).__init__()
+        self._spans = [_TransactionSpan(span, None, time.monotonic())]
+
+    @property
+    def current_span(self):
+        '''
+        Gets the span of the innermost transaction/savepoint.
+        '''
+        return self._spans[-1].span
+
+    def begin_savepoint(self, span, name):
+        self._spans.append(_TransactionSpan(span, name, time.monotonic()))
+
+    def end_savepoint(self, name, outcome):
+        '''
+        Finish the span of a savepoint, as well as the
+        ones of any savepoint nested in it.
+        '''
+        if len(self._spans) < 2:
+            return
+
+        # Savepoints are only named by SQLAlchemy after they start,
+        # so unknown names refer to the innermost one.
+        names = [entry.savepoint for entry in self._spans]
+        if name in names[1:]:
+            index = names.index(name)
+        else:
+            index = len(self._spans) - 1
+            self._spans[index].savepoint = name
+
+        now = time.monotonic()
+        while len(self._spans) > index:
+            self._spans.pop().finish(outcome, now)
+
+    def end(self, outcome):
+        '''
+        Finish all the spans, innermost first.
+        '''
+        now = time.monotonic()
+        while self._spans:
+            self._spans.pop().finish(outcome, now)
+
+    def statement_started(self):
+        now = time.monotonic()
+        for entry in self._spans:
+            entry.statements += 1
+            if entry.idle_since is not None:
+                entry.idle_time += now - entry.idle_since
+                entry.idle_since = None
+
+    def statement_finished(self):
+        now = time.monotonic()
+        for entry in self._spans:
+            entry.idle_since = now
@@ -9,22 +9,34 @@ class DummyTracer(object):
     def clear(self):
         self.spans = []
 
-    def start_span(self, operation_name, child_of=None):
-        span = DummySpan(operation_name, child_of=child_of)
+    def start_span(self, operation_name, child_of=None, references=None,
+                   start_time=None):
+        span = DummySpan(operation_name, child_of=child_of,
+                         references=references, start_time=start_time)
         self.spans.append(span)
         return span
 
 class DummySpan(object):
-    def __init__(self, operation_name='span', child_of=None):
+    def __init__(self, operation_name='span', child_of=None, references=None,
+                 start_time=None):
         super(DummySpan, self).__init__()
         self.operation_name = operation_name
         self.child_of = child_of
+        self.references = references
+        self.context = object()
+        self.start_time = start_time
+        self.finish_time = None
         self.tags = {}
+        self.logs = []
         self.is_finished = False
 
     def set_tag(self, name, value):
         self.tags[name] = value
 
-    def finish(self):
+    def log_kv(self, key_values, timestamp=None):
+        self.logs.append((key_values, timestamp))
+
+    def finish(self, finish_time=None):
+        self.finish_time = finish_time
         self.is_finished = True
 
@@ -23,23 +23,23 @@ class TestGlobalCalls(unittest.TestCase):
     def test_init(self, mock_register):
         tracer = DummyTracer()
         sqlalchemy_opentracing.init_tracing(tracer)
-        self.assertEqual(tracer, sqlalchemy_opentracing.g_tracer)
-        self.assertEqual(True, sqlalchemy_opentracing.g_trace_all_queries)
+        self.assertEqual(tracer, sqlalchemy_opentracing.g_config.tracer)
+        self.assertEqual(True, sqlalchemy_opentracing.g_config.trace_all_queries)
 
     @patch('sqlalchemy_opentracing.register_engine')
     def test_init_subtracer(self, mock_register):
         tracer = DummyTracer(with_subtracer=True)
         sqlalchemy_opentracing.init_tracing(tracer)
-        self.assertEqual(tracer._tracer, sqlalchemy_opentracing.g_tracer)
-        self.assertEqual(True, sqlalchemy_opentracing.g_trace_all_queries)
+        self.assertEqual(tracer._tracer, sqlalchemy_opentracing.g_config.tracer)
+        self.assertEqual(True, sqlalchemy_opentracing.g_config.trace_all_queries)
 
     @patch('sqlalchemy_opentracing.register_engine')
     def test_init_trace_all_queries(self, mock_register):
         sqlalchemy_opentracing.init_tracing(DummyTracer(), trace_all_queries=False)
-        self.assertEqual(False, sqlalchemy_opentracing.g_trace_all_queries)
+        self.assertEqual(False, sqlalchemy_opentracing.g_config.trace_all_queries)
 
         sqlalchemy_opentracing.init_tracing(DummyTracer(), trace_all_queries=True)
-        self.assertEqual(True, sqlalchemy_opentracing.g_trace_all_queries)
+        self.assertEqual(True, sqlalchemy_opentracing.g_config.trace_all_queries)
 
     @patch('sqlalchemy_opentracing.register_engine')
     def test_init_trace_all_engines(self, mock_register):
@@ -53,6 +53,50 @@ class TestGlobalCalls(unittest.TestCase):
         sqlalchemy_opentracing.init_tracing(tracer, trace_all_engines=True)
         self.assertEqual(2, mock_register.call_count) # Called again
 
+    @patch('sqlalchemy_opentracing.register_engine')
+    def test_init_sampling(self, mock_register):
+        sqlalchemy_opentracing.init_tracing(DummyTracer())
+        self.assertEqual(1.0, sqlalchemy_opentracing.g_config.sample_rate)
+        self.assertEqual({}, sqlalchemy_opentracing.g_config.operation_sample_rates)
+        self.assertEqual(False, sqlalchemy_opentracing.g_config.sampling)
+
+        sqlalchemy_opentracing.init_tracing(DummyTracer(),
+                                            sample_rate=0.5,
+                                            operation_sample_rates={'insert': 1.0})
+        self.assertEqual(0.5, sqlalchemy_opentracing.g_config.sample_rate)
+        self.assertEqual({'insert': 1.0}, sqlalchemy_opentracing.g_config.operation_sample_rates)
+        self.assertEqual(True, sqlalchemy_opentracing.g_config.sampling)
+
+    @patch('sqlalchemy_opentracing.register_engine')
+    def test_init_sampling_invalid(self, mock_register):
+        with self.assertRaises(ValueError):
+            sqlalchemy_opentracing.init_tracing(DummyTracer(), sample_rate=1.5)
+        with self.assertRaises(ValueError):
+            sqlalchemy_opentracing.init_tracing(DummyTracer(),
+                                                operation_sample_rates={'select': -1})
+
+    @patch('sqlalchemy_opentracing.register_engine')
+    def test_stmt_cache(self, mock_register):
+        sqlalchemy_opentracing.init_tracing(DummyTracer(), stmt_cache_size=2,
+                                            stmt_cache_max_length=20)
+        normalize = sqlalchemy_opentracing._normalize_stmt
+
+        self.assertEqual('SELECT 1', normalize('\n\tSELECT 1 '))
+        self.assertEqual('SELECT 1', normalize('\n\tSELECT 1 '))
+        info = sqlalchemy_opentracing.get_stmt_cache_info()
+        self.assertEqual((1, 1, 2, 1), (info.hits, info.misses, info.maxsize, info.currsize))
+
+        # Bounded size.
+        normalize('SELECT 2')
+        normalize('SELECT 3')
+        self.assertEqual(2, sqlalchemy_opentracing.get_stmt_cache_info().currsize)
+
+        # Statements above the size limit bypass the cache.
+        long_stmt = 'SELECT id, name\nFROM users'
+        self.assertEqual('SELECT id, nameFROM users', normalize(long_stmt))
+        info = sqlalchemy_opentracing.get_stmt_cache_info()
+        self.assertEqual((1, 3), (info.hits, info.misses))
+
     def test_traced_property(self):
         stmt_obj = CreateTable(self.users_table)
         sqlalchemy_opentracing.set_traced(stmt_obj)
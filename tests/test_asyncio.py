@@ -0,0 +1,142 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import select
+
+try:
+    import aiosqlite
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+except ImportError:
+    aiosqlite = None
+
+import sqlalchemy_opentracing
+from .dummies import *
+
+Base = declarative_base()
+
+class User(Base):
+    __tablename__ = 'users'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+@unittest.skipIf(aiosqlite is None, 'aiosqlite and SQLAlchemy 1.4+ are required')
+class TestSQLAlchemyAsyncio(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = create_async_engine('sqlite+aiosqlite:///%s' % self.db_path)
+        self.tracer = DummyTracer()
+
+        async def create_all():
+            async with self.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+
+        self.run_async(create_all())
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+        self.run_async(self.engine.dispose())
+        os.remove(self.db_path)
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_traced_engine(self):
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        async def run():
+            async with self.engine.begin() as conn:
+                await conn.execute(User.__table__.insert().values(name='John Doe'))
+
+        self.run_async(run())
+
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual('insert', self.tracer.spans[0].operation_name)
+        self.assertEqual(True, self.tracer.spans[0].is_finished)
+        self.assertEqual(self.tracer.spans[0].tags, {
+            'component': 'sqlalchemy',
+            'db.statement': 'INSERT INTO users (name) VALUES (?)',
+            'db.type': 'sql',
+            'sqlalchemy.dialect': 'sqlite',
+        })
+
+    def test_traced_connection(self):
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        parent_span = DummySpan('parent')
+
+        async def run():
+            async with self.engine.connect() as conn:
+                async with conn.begin():
+                    sqlalchemy_opentracing.set_parent_span(conn, parent_span)
+                    self.assertEqual(True, sqlalchemy_opentracing.get_traced(conn))
+                    await conn.execute(User.__table__.insert().values(name='John Doe'))
+                    await conn.execute(select(User.__table__))
+
+        self.run_async(run())
+
+        self.assertEqual(['insert', 'select'],
+                         [span.operation_name for span in self.tracer.spans])
+        self.assertEqual(True, all(map(lambda x: x.child_of == parent_span, self.tracer.spans)))
+
+    def test_traced_session(self):
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        parent_span = DummySpan('parent')
+
+        async def run():
+            async with AsyncSession(self.engine) as session:
+                sqlalchemy_opentracing.set_parent_span(session, parent_span)
+                session.add(User(name='John Doe'))
+                await session.commit()
+
+                # Not traced anymore.
+                self.assertEqual(False, sqlalchemy_opentracing.get_traced(session))
+                await session.execute(select(User))
+
+        self.run_async(run())
+
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual('insert', self.tracer.spans[0].operation_name)
+        self.assertEqual(parent_span, self.tracer.spans[0].child_of)
+
+    def test_concurrent_tasks(self):
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        async def run_session(parent_span):
+            async with AsyncSession(self.engine) as session:
+                sqlalchemy_opentracing.set_parent_span(session, parent_span)
+                for i in range(5):
+                    await session.execute(select(User))
+                    await asyncio.sleep(0)
+                await session.commit()
+
+        async def run_current(parent_span):
+            sqlalchemy_opentracing.set_current_span(parent_span)
+            async with self.engine.connect() as conn:
+                for i in range(5):
+                    await conn.execute(select(User.__table__))
+                    await asyncio.sleep(0)
+
+        session_spans = [DummySpan('session-%s' % i) for i in range(5)]
+        current_spans = [DummySpan('current-%s' % i) for i in range(5)]
+
+        async def main():
+            await asyncio.gather(*([run_session(span) for span in session_spans] +
+                                   [run_current(span) for span in current_spans]))
+
+        self.run_async(main())
+
+        self.assertEqual(50, len(self.tracer.spans))
+        for parent_span in session_spans + current_spans:
+            children = [span for span in self.tracer.spans if span.child_of == parent_span]
+            self.assertEqual(5, len(children))
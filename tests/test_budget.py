@@ -0,0 +1,120 @@
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import select
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.budget import QueryBudget, QueryBudgetExceeded
+from .dummies import *
+
+class TestQueryBudget(unittest.TestCase):
+    def test_limits(self):
+        budget = QueryBudget(max_queries=1, max_db_time=1.0)
+        self.assertEqual(False, budget.add_query())
+        self.assertEqual(True, budget.add_query())
+        self.assertEqual(False, budget.add_db_time(0.5))
+        self.assertEqual(True, budget.add_db_time(0.6))
+        self.assertEqual(2, budget.queries)
+        self.assertAlmostEqual(1.1, budget.db_time)
+
+    def test_no_limits(self):
+        budget = QueryBudget()
+        self.assertEqual(False, budget.add_query())
+        self.assertEqual(False, budget.add_db_time(100.0))
+
+    def test_invalid_action(self):
+        with self.assertRaises(ValueError):
+            QueryBudget(max_queries=1, action='ignore')
+
+class TestQueryBudgetTracing(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.users_table = Table('users', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('name', String),
+        )
+        self.engine.execute(CreateTable(self.users_table))
+
+        self.tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_parent_span_tag(self):
+        parent_span = DummySpan('parent span')
+        budget = sqlalchemy_opentracing.set_query_budget(parent_span,
+                                                         max_queries=1)
+        self.assertEqual(budget, sqlalchemy_opentracing.get_query_budget(parent_span))
+
+        for name in ('John Doe', 'Jason Bourne'):
+            ins = self.users_table.insert().values(name=name)
+            sqlalchemy_opentracing.set_parent_span(ins, parent_span)
+            self.engine.execute(ins)
+
+        self.assertEqual(2, len(self.tracer.spans))
+        self.assertNotIn('sqlalchemy.query_budget_exceeded', self.tracer.spans[0].tags)
+        self.assertEqual(True, self.tracer.spans[1].tags['sqlalchemy.query_budget_exceeded'])
+        self.assertEqual(2, budget.queries)
+        self.assertEqual(True, budget.exceeded)
+
+    def test_db_time_tag(self):
+        parent_span = DummySpan('parent span')
+        budget = sqlalchemy_opentracing.set_query_budget(parent_span,
+                                                         max_db_time=0.0)
+
+        sel = select([self.users_table])
+        sqlalchemy_opentracing.set_parent_span(sel, parent_span)
+        self.engine.execute(sel)
+
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual(True, self.tracer.spans[0].tags['sqlalchemy.query_budget_exceeded'])
+        self.assertEqual(True, self.tracer.spans[0].is_finished)
+        self.assertEqual(True, budget.db_time > 0.0)
+
+    def test_session_raise(self):
+        session = sessionmaker(bind=self.engine)()
+        budget = sqlalchemy_opentracing.set_query_budget(session, max_queries=2,
+                                                         action='raise')
+
+        # Accounted even if not traced.
+        session.execute(select([self.users_table]))
+        session.execute(select([self.users_table]))
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            session.execute(select([self.users_table]))
+
+        self.assertEqual(budget, cm.exception.budget)
+        self.assertEqual(3, budget.queries)
+        self.assertEqual(0, len(self.tracer.spans))
+        session.rollback()
+
+        # The budget outlives the session transactions.
+        with self.assertRaises(QueryBudgetExceeded):
+            session.execute(select([self.users_table]))
+        session.rollback()
+
+        sqlalchemy_opentracing.clear_query_budget(session)
+        self.assertEqual(None, sqlalchemy_opentracing.get_query_budget(session))
+        session.execute(select([self.users_table]))
+        session.close()
+
+    def test_connection_warn(self):
+        conn = self.engine.connect()
+        sqlalchemy_opentracing.set_traced(conn)
+        sqlalchemy_opentracing.set_query_budget(conn, max_queries=1,
+                                                action='warn')
+
+        with self.assertLogs('sqlalchemy_opentracing', level='WARNING') as cm:
+            for i in range(3):
+                conn.execute(select([self.users_table]))
+
+        # Warned only once, but all the spans are tagged.
+        self.assertEqual(1, len(cm.output))
+        self.assertEqual(3, len(self.tracer.spans))
+        self.assertEqual([False, True, True],
+                         [span.tags.get('sqlalchemy.query_budget_exceeded', False)
+                          for span in self.tracer.spans])
+        conn.close()
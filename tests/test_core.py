@@ -1,3 +1,4 @@
+import time
 import unittest
 from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
 from sqlalchemy.engine import Engine
@@ -58,6 +59,204 @@ class TestSQLAlchemyCore(unittest.TestCase):
 
         self.assertEqual(1, len(tracer.spans))
 
+    def test_traced_sampled_out(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            sample_rate=0.0)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        creat = CreateTable(self.users_table)
+        sqlalchemy_opentracing.set_traced(creat)
+        self.engine.execute(creat)
+
+        self.assertEqual(0, len(tracer.spans))
+        self.assertEqual(False, sqlalchemy_opentracing.get_traced(creat))
+
+    def test_traced_sampled_per_operation(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            sample_rate=0.0,
+                                            operation_sample_rates={'insert': 1.0})
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.engine.execute(select([self.users_table]))
+
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual('insert', tracer.spans[0].operation_name)
+        self.assertEqual(True, tracer.spans[0].is_finished)
+
+    def test_traced_slow_queries(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=False,
+                                            slow_query_threshold=0.0)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        creat = CreateTable(self.users_table)
+        sqlalchemy_opentracing.set_traced(creat)
+        self.engine.execute(creat)
+
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual('create_table', tracer.spans[0].operation_name)
+        self.assertEqual(True, tracer.spans[0].is_finished)
+        self.assertEqual(True, tracer.spans[0].start_time <= time.time())
+        self.assertEqual(tracer.spans[0].tags, {
+            'component': 'sqlalchemy',
+            'db.statement': 'CREATE TABLE users (id INTEGER NOT NULL, name VARCHAR, PRIMARY KEY (id))',
+            'db.type': 'sql',
+            'sqlalchemy.dialect': 'sqlite',
+        })
+        self.assertEqual(False, sqlalchemy_opentracing.get_traced(creat))
+
+    def test_traced_slow_queries_fast(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=False,
+                                            slow_query_threshold=60.0)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        creat = CreateTable(self.users_table)
+        sqlalchemy_opentracing.set_traced(creat)
+        self.engine.execute(creat)
+
+        self.assertEqual(0, len(tracer.spans))
+        self.assertEqual(False, sqlalchemy_opentracing.get_traced(creat))
+
+    def test_traced_slow_queries_error(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            slow_query_threshold=60.0)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        creat = CreateTable(self.users_table)
+        self.engine.execute(creat)
+        try:
+            self.engine.execute(creat)
+        except OperationalError:
+            pass
+
+        # Only the failed query is reported.
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual(True, tracer.spans[0].is_finished)
+        self.assertEqual(True, tracer.spans[0].start_time is not None)
+        self.assertEqual('true', tracer.spans[0].tags['error'])
+        self.assertEqual('table users already exists',
+                         tracer.spans[0].tags['sqlalchemy.exception'])
+
+    def test_traced_truncated_statement(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            max_statement_length=30)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(select([self.users_table.c.id]))
+
+        self.assertEqual(2, len(tracer.spans))
+        self.assertEqual(tracer.spans[0].tags, {
+            'component': 'sqlalchemy',
+            'db.statement': 'CREATE TABLE users (id INTE...',
+            'db.statement.length': 82,
+            'db.type': 'sql',
+            'sqlalchemy.dialect': 'sqlite',
+        })
+        # Short enough statements are not truncated.
+        self.assertEqual('SELECT users.id FROM users',
+                         tracer.spans[1].tags['db.statement'])
+
+    def test_traced_fingerprint(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            fingerprint_statements=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute('SELECT name FROM users WHERE id = 1')
+        self.engine.execute('SELECT name FROM users WHERE id = 2')
+
+        self.assertEqual(3, len(tracer.spans))
+        fingerprints = [span.tags['db.statement.fingerprint'] for span in tracer.spans]
+        self.assertNotEqual(fingerprints[0], fingerprints[1])
+        self.assertEqual(fingerprints[1], fingerprints[2])
+
+    def test_traced_fetch(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_fetch=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert(), [
+            {'name': 'John Doe'},
+            {'name': 'Jason Bourne'},
+            {'name': 'Foo Bar'},
+        ])
+
+        result = self.engine.execute(select([self.users_table]))
+        self.assertEqual(False, tracer.spans[2].is_finished)
+        self.assertEqual(1, len(result.fetchmany(1)))
+        self.assertEqual(False, tracer.spans[2].is_finished)
+        self.assertEqual(2, len(result.fetchall()))
+
+        self.assertEqual(3, len(tracer.spans))
+        self.assertEqual(True, all(map(lambda x: x.is_finished, tracer.spans)))
+
+        tags = tracer.spans[2].tags
+        self.assertEqual(3, tags['db.rows_fetched'])
+        self.assertEqual(True, tags['sqlalchemy.execute_time'] >= 0)
+        self.assertEqual(True, tags['sqlalchemy.fetch_time'] >= 0)
+
+        # Statements not returning rows.
+        self.assertEqual(0, tracer.spans[1].tags['db.rows_fetched'])
+        self.assertEqual(3, tracer.spans[1].tags['db.rowcount'])
+
+    def test_traced_fetch_closed(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_fetch=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.engine.execute(self.users_table.insert().values(name='Jason Bourne'))
+
+        result = self.engine.execute(select([self.users_table]))
+        result.fetchone()
+        result.close()
+
+        self.assertEqual(True, tracer.spans[3].is_finished)
+        self.assertEqual(1, tracer.spans[3].tags['db.rows_fetched'])
+
+    def test_traced_stream_results(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert(), [
+            {'name': 'User-%s' % i} for i in range(50)
+        ])
+
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True, max_row_buffer=10)
+            result = conn.execute(select([self.users_table]))
+            self.assertEqual(False, tracer.spans[2].is_finished)
+            self.assertEqual(50, len([row for row in result]))
+
+        self.assertEqual(3, len(tracer.spans))
+        self.assertEqual(True, tracer.spans[2].is_finished)
+
+        tags = tracer.spans[2].tags
+        self.assertEqual(True, tags['sqlalchemy.stream_results'])
+        self.assertEqual(50, tags['db.rows_fetched'])
+        self.assertEqual(True, tags['db.fetch_batches'] > 1)
+        self.assertEqual(10, tags['db.rows_per_batch.max'])
+        self.assertEqual(50.0 / tags['db.fetch_batches'], tags['db.rows_per_batch'])
+        self.assertEqual(True, tags['db.time_to_first_row'] >= tags['sqlalchemy.execute_time'])
+
+        # Regular queries are not affected.
+        self.assertEqual(False, 'db.rows_fetched' in tracer.spans[1].tags)
+
     def test_traced_all_engines(self):
         # Don't register the engine explicitly.
         tracer = DummyTracer()
@@ -312,3 +511,245 @@ class TestSQLAlchemyCore(unittest.TestCase):
         self.engine.execute(sel)
         self.assertEqual(0, len(tracer.spans))
 
+    def test_traced_n_plus_one_parent_span(self):
+        tracer = DummyTracer()
+        reported = []
+        sqlalchemy_opentracing.init_tracing(tracer, False, False,
+                                            n_plus_one_threshold=1,
+                                            n_plus_one_callback=lambda *args: reported.append(args))
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+
+        parent_span = DummySpan('parent span')
+        for name in ('John Doe', 'Jason Bourne', 'Foo Bar'):
+            ins = self.users_table.insert().values(name=name)
+            sqlalchemy_opentracing.set_parent_span(ins, parent_span)
+            self.engine.execute(ins)
+
+        # Same statement shape, but under another parent span.
+        sel = select([self.users_table])
+        sqlalchemy_opentracing.set_parent_span(sel, DummySpan('other parent span'))
+        self.engine.execute(sel)
+
+        self.assertEqual(4, len(tracer.spans))
+        self.assertNotIn('sqlalchemy.n_plus_one', tracer.spans[0].tags)
+        self.assertEqual(2, tracer.spans[1].tags['sqlalchemy.n_plus_one.count'])
+        self.assertEqual(3, tracer.spans[2].tags['sqlalchemy.n_plus_one.count'])
+        self.assertNotIn('sqlalchemy.n_plus_one', tracer.spans[3].tags)
+
+        # Reported only once, when crossing the threshold.
+        self.assertEqual([('INSERT INTO users (name) VALUES (?)', 2, parent_span)],
+                         reported)
+
+    def test_traced_same_shape(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+
+        # Statements of the same shape share their compiled form.
+        ins1 = self.users_table.insert().values(name='John Doe')
+        ins2 = self.users_table.insert().values(name='Jason Bourne')
+        sqlalchemy_opentracing.set_traced(ins1)
+        sqlalchemy_opentracing.set_traced(ins2)
+        self.engine.execute(ins1)
+        self.engine.execute(ins2)
+
+        self.assertEqual(2, len(tracer.spans))
+        self.assertEqual(False, sqlalchemy_opentracing.get_traced(ins1))
+        self.assertEqual(False, sqlalchemy_opentracing.get_traced(ins2))
+
+    def test_disable_tracing(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.assertEqual(1, len(tracer.spans))
+
+        sqlalchemy_opentracing.disable_tracing()
+        self.assertEqual(False, sqlalchemy_opentracing.is_tracing_enabled())
+        self.assertEqual(False, sqlalchemy_opentracing.is_tracing_enabled(self.engine))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.assertEqual(1, len(tracer.spans))
+
+        sqlalchemy_opentracing.enable_tracing()
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.assertEqual(2, len(tracer.spans))
+
+    def test_disable_tracing_engine(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        other_engine = create_engine('sqlite:///:memory:')
+        sqlalchemy_opentracing.register_engine(other_engine)
+
+        sqlalchemy_opentracing.disable_tracing(self.engine)
+        self.assertEqual(True, sqlalchemy_opentracing.is_tracing_enabled())
+        self.assertEqual(False, sqlalchemy_opentracing.is_tracing_enabled(self.engine))
+        self.assertEqual(True, sqlalchemy_opentracing.is_tracing_enabled(other_engine))
+
+        self.engine.execute(CreateTable(self.users_table))
+        other_engine.execute(CreateTable(self.users_table))
+        self.assertEqual(1, len(tracer.spans))
+
+        # Failing queries are skipped as well.
+        with self.assertRaises(OperationalError):
+            self.engine.execute(CreateTable(self.users_table))
+        self.assertEqual(1, len(tracer.spans))
+
+        sqlalchemy_opentracing.enable_tracing(self.engine)
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.assertEqual(2, len(tracer.spans))
+
+        sqlalchemy_opentracing.unregister_engine(other_engine)
+
+    def test_disable_tracing_option_engine(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        option_engine = self.engine.execution_options(isolation_level='SERIALIZABLE')
+        sqlalchemy_opentracing.disable_tracing(self.engine)
+        self.assertEqual(False, sqlalchemy_opentracing.is_tracing_enabled(option_engine))
+
+        option_engine.execute(CreateTable(self.users_table))
+        self.assertEqual(0, len(tracer.spans))
+
+        sqlalchemy_opentracing.enable_tracing(option_engine)
+        option_engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.assertEqual(1, len(tracer.spans))
+
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+
+    def test_traced_compilation(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_compilation=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        for name in ('John Doe', 'Jason Bourne'):
+            self.engine.execute(self.users_table.insert().values(name=name))
+
+        self.assertEqual(3, len(tracer.spans))
+        self.assertEqual(['no_key', 'miss', 'hit'],
+                         [span.tags['sqlalchemy.compiled_cache'] for span in tracer.spans])
+        self.assertEqual(True, all(map(lambda x: x.tags['sqlalchemy.compile_time'] >= 0.0,
+                                       tracer.spans)))
+
+        self.assertEqual({
+            'no_key': 1,
+            'miss': 1,
+            'hit': 1,
+            'hit_ratio': 0.5,
+        }, sqlalchemy_opentracing.get_compiled_cache_stats(self.engine))
+
+        # Raw SQL is not compiled.
+        tracer.clear()
+        self.engine.execute('SELECT * FROM users')
+        self.assertEqual(1, len(tracer.spans))
+        self.assertNotIn('sqlalchemy.compile_time', tracer.spans[0].tags)
+        self.assertNotIn('sqlalchemy.compiled_cache', tracer.spans[0].tags)
+
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+
+    def test_traced_compilation_option_engine(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_compilation=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        option_engine = self.engine.execution_options(isolation_level='SERIALIZABLE')
+        option_engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+
+        # Accounted along the statements of their engine.
+        stats = sqlalchemy_opentracing.get_compiled_cache_stats(option_engine)
+        self.assertEqual(stats, sqlalchemy_opentracing.get_compiled_cache_stats(self.engine))
+        self.assertEqual(1, stats['no_key'])
+        self.assertEqual(1, stats['miss'])
+
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+
+    def test_traced_transaction_span(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False,
+                                            trace_transactions=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        parent_span = DummySpan('parent span')
+        conn = self.engine.connect()
+        sqlalchemy_opentracing.set_parent_span(conn, parent_span)
+        with conn.begin() as tx:
+            conn.execute(CreateTable(self.users_table))
+            time.sleep(0.01)
+            conn.execute(self.users_table.insert().values(name='John Doe'))
+
+        self.assertEqual(['transaction', 'create_table', 'insert'],
+                         [span.operation_name for span in tracer.spans])
+
+        tx_span = tracer.spans[0]
+        self.assertEqual(True, tx_span.is_finished)
+        self.assertEqual(parent_span, tx_span.child_of)
+        self.assertEqual('commit', tx_span.tags['sqlalchemy.transaction.outcome'])
+        self.assertEqual(2, tx_span.tags['sqlalchemy.transaction.statements'])
+        self.assertEqual(True, tx_span.tags['sqlalchemy.transaction.idle_time'] >= 0.01)
+
+        # Traced only till the transaction is done.
+        tracer.clear()
+        with conn.begin():
+            conn.execute(select([self.users_table]))
+        self.assertEqual(0, len(tracer.spans))
+        conn.close()
+
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+
+    def test_traced_transaction_span_savepoint(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False,
+                                            trace_transactions=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        conn = self.engine.connect()
+        conn.execute(CreateTable(self.users_table))
+
+        tx = conn.begin()
+        sqlalchemy_opentracing.set_traced(conn)
+        conn.execute(self.users_table.insert().values(name='John Doe'))
+
+        nested = conn.begin_nested()
+        conn.execute(self.users_table.insert().values(name='Jason Bourne'))
+        nested.rollback()
+
+        nested = conn.begin_nested()
+        conn.execute(self.users_table.insert().values(name='Foo Bar'))
+        nested.commit()
+
+        tx.rollback()
+        conn.close()
+
+        tx_span = tracer.spans[0]
+        savepoint_spans = [span for span in tracer.spans
+                           if span.operation_name == 'nested_transaction']
+        self.assertEqual('transaction', tx_span.operation_name)
+        self.assertEqual(2, len(savepoint_spans))
+        self.assertEqual(True, all(map(lambda x: x.is_finished, tracer.spans)))
+        self.assertEqual(True, all(map(lambda x: x.child_of == tx_span,
+                                       savepoint_spans)))
+
+        self.assertEqual('rollback', tx_span.tags['sqlalchemy.transaction.outcome'])
+        self.assertEqual(['rollback', 'release'],
+                         [span.tags['sqlalchemy.transaction.outcome']
+                          for span in savepoint_spans])
+        self.assertEqual(['sa_savepoint_1', 'sa_savepoint_2'],
+                         [span.tags['sqlalchemy.savepoint'] for span in savepoint_spans])
+
+        # SAVEPOINT/RELEASE/ROLLBACK TO statements are accounted as well.
+        self.assertEqual(7, tx_span.tags['sqlalchemy.transaction.statements'])
+        self.assertEqual(2, savepoint_spans[0].tags['sqlalchemy.transaction.statements'])
+
+        sqlalchemy_opentracing.unregister_engine(self.engine)
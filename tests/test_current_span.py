@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import select
+
+import sqlalchemy_opentracing
+from .dummies import *
+
+class TestCurrentSpan(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.users_table = Table('users', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('name', String),
+        )
+        self.tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_current_span(self):
+        parent_span = DummySpan('parent')
+        token = sqlalchemy_opentracing.set_current_span(parent_span)
+        try:
+            self.assertEqual(parent_span, sqlalchemy_opentracing.get_current_span())
+            self.engine.execute(CreateTable(self.users_table))
+            self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        finally:
+            sqlalchemy_opentracing.reset_current_span(token)
+
+        self.assertEqual(None, sqlalchemy_opentracing.get_current_span())
+
+        # No longer traced.
+        self.engine.execute(select([self.users_table]))
+
+        self.assertEqual(['create_table', 'insert'],
+                         [span.operation_name for span in self.tracer.spans])
+        self.assertEqual(True, all(map(lambda x: x.child_of == parent_span, self.tracer.spans)))
+
+    def test_explicit_parent(self):
+        parent_span = DummySpan('parent')
+        stmt_parent_span = DummySpan('stmt parent')
+        token = sqlalchemy_opentracing.set_current_span(parent_span)
+        try:
+            creat = CreateTable(self.users_table)
+            sqlalchemy_opentracing.set_parent_span(creat, stmt_parent_span)
+            self.engine.execute(creat)
+        finally:
+            sqlalchemy_opentracing.reset_current_span(token)
+
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual(stmt_parent_span, self.tracer.spans[0].child_of)
+
+    def test_threads(self):
+        # Each thread gets its own in-memory database.
+        def run(parent_span):
+            sqlalchemy_opentracing.set_current_span(parent_span)
+            for i in range(10):
+                self.engine.execute('SELECT 1')
+
+        parent_spans = [DummySpan('parent-%s' % i) for i in range(4)]
+        threads = [threading.Thread(target=run, args=(span,)) for span in parent_spans]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(None, sqlalchemy_opentracing.get_current_span())
+        self.assertEqual(40, len(self.tracer.spans))
+        for parent_span in parent_spans:
+            children = [span for span in self.tracer.spans if span.child_of == parent_span]
+            self.assertEqual(10, len(children))
+
+    def test_asyncio_tasks(self):
+        async def run(parent_span):
+            sqlalchemy_opentracing.set_current_span(parent_span)
+            for i in range(10):
+                self.engine.execute('SELECT 1')
+                await asyncio.sleep(0)
+
+        async def main(parent_spans):
+            await asyncio.gather(*[run(span) for span in parent_spans])
+
+        parent_spans = [DummySpan('parent-%s' % i) for i in range(4)]
+        asyncio.run(main(parent_spans))
+
+        self.assertEqual(40, len(self.tracer.spans))
+        for parent_span in parent_spans:
+            children = [span for span in self.tracer.spans if span.child_of == parent_span]
+            self.assertEqual(10, len(children))
@@ -0,0 +1,77 @@
+import unittest
+
+from sqlalchemy_opentracing import fingerprint
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        fingerprint.clear_cache()
+
+    def test_literals(self):
+        text, digest = fingerprint.get_fingerprint(
+            "SELECT * FROM users WHERE name = 'O''Brien' AND age > 42 AND score < -1.5e3")
+        self.assertEqual('SELECT * FROM users WHERE name = ? AND age > ? AND score < ?', text)
+        self.assertEqual(16, len(digest))
+
+    def test_identifiers(self):
+        text, digest = fingerprint.get_fingerprint('SELECT t1.id, users2.name FROM t1, users2')
+        self.assertEqual('SELECT t1.id, users2.name FROM t1, users2', text)
+
+    def test_whitespace_and_comments(self):
+        text, digest = fingerprint.get_fingerprint(
+            '\n\tSELECT id  -- the id\n FROM users /* all of them */\n')
+        self.assertEqual('SELECT id FROM users', text)
+
+    def test_params(self):
+        sqlite = fingerprint.get_fingerprint('SELECT id FROM users WHERE id IN (?, ?, ?)')
+        pg = fingerprint.get_fingerprint(
+            'SELECT id FROM users WHERE id IN (%(id_1_1)s, %(id_1_2)s)')
+        oracle = fingerprint.get_fingerprint('SELECT id FROM users WHERE id IN (:id_1, :id_2)')
+        literals = fingerprint.get_fingerprint('SELECT id FROM users WHERE id IN (1, 2, 3, 4)')
+
+        self.assertEqual('SELECT id FROM users WHERE id IN (?+)', sqlite[0])
+        self.assertEqual(sqlite, pg)
+        self.assertEqual(sqlite, oracle)
+        self.assertEqual(sqlite, literals)
+
+    def test_comment_markers_in_literals(self):
+        a = fingerprint.get_fingerprint("SELECT 'a--b', 1 FROM t")
+        b = fingerprint.get_fingerprint("SELECT 'a/*b', name FROM users /* 'c' */")
+        self.assertEqual('SELECT ?, ? FROM t', a[0])
+        self.assertEqual('SELECT ?, name FROM users', b[0])
+
+    def test_numbered_params(self):
+        text, digest = fingerprint.get_fingerprint(
+            'SELECT id FROM users WHERE id IN ($1, $2, $3) AND age > $4')
+        self.assertEqual('SELECT id FROM users WHERE id IN (?+) AND age > ?', text)
+
+    def test_single_item_lists(self):
+        one = fingerprint.get_fingerprint('SELECT id FROM users WHERE id IN (?)')
+        two = fingerprint.get_fingerprint('SELECT id FROM users WHERE id IN (?, ?)')
+        self.assertEqual('SELECT id FROM users WHERE id IN (?+)', one[0])
+        self.assertEqual(one, two)
+
+        # Only IN lists are collapsed.
+        text, digest = fingerprint.get_fingerprint('INSERT INTO users (name) VALUES (lower(?))')
+        self.assertEqual('INSERT INTO users (name) VALUES (lower(?))', text)
+
+    def test_casts(self):
+        text, digest = fingerprint.get_fingerprint('SELECT :value::integer')
+        self.assertEqual('SELECT ?::integer', text)
+
+    def test_stable_hash(self):
+        a = fingerprint.get_fingerprint('SELECT id FROM users WHERE id = 1')
+        b = fingerprint.get_fingerprint('SELECT id FROM users WHERE id = 2')
+        c = fingerprint.get_fingerprint('SELECT name FROM users WHERE id = 2')
+        self.assertEqual(a, b)
+        self.assertNotEqual(a[1], c[1])
+
+    def test_memoized(self):
+        fingerprint.get_fingerprint('SELECT 1')
+        fingerprint.get_fingerprint('SELECT 1')
+        info = fingerprint.cache_info()
+        self.assertEqual((1, 1), (info.hits, info.misses))
+
+        # Huge statements are not cached.
+        fingerprint.get_fingerprint('SELECT 1' + ' ' * fingerprint.CACHE_MAX_LENGTH)
+        info = fingerprint.cache_info()
+        self.assertEqual((1, 1, 1), (info.hits, info.misses, info.currsize))
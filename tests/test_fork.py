@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import select
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.reporter import AsyncFinishTracer
+from sqlalchemy_opentracing.stats import QueryStats
+from .dummies import *
+
+users_table = Table('users', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+)
+
+# Set up by the test case, and inherited by the forked workers.
+g_fork_state = {}
+
+def _run_worker(nqueries):
+    engine = g_fork_state['engine']
+    reporter = g_fork_state['reporter']
+    stats = g_fork_state['stats']
+
+    with engine.connect() as conn:
+        for i in range(nqueries):
+            conn.execute(select([users_table]))
+
+    reporter.close()
+    return (os.getpid(),
+            len(reporter.tracer.spans),
+            sum(entry['count'] for entry in stats.snapshot().values()))
+
+@unittest.skipIf(not hasattr(os, 'register_at_fork'), 'fork is not available')
+class TestFork(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///' + os.path.join(self.db_dir, 'test.db'),
+                                    poolclass=NullPool)
+        self.engine.execute(CreateTable(users_table))
+
+        self.reporter = AsyncFinishTracer(DummyTracer(), flush_interval=60.0)
+        self.stats = QueryStats()
+        sqlalchemy_opentracing.init_tracing(self.reporter, False,
+                                            trace_all_queries=True,
+                                            query_stats=self.stats)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        g_fork_state.update(engine=self.engine,
+                            reporter=self.reporter,
+                            stats=self.stats)
+
+    def tearDown(self):
+        g_fork_state.clear()
+        self.reporter.close()
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+        shutil.rmtree(self.db_dir)
+
+    def test_fork_workers(self):
+        # Pending spans and statistics in the parent process.
+        self.engine.execute(users_table.insert().values(name='John Doe'))
+        self.engine.execute(select([users_table]))
+
+        context = multiprocessing.get_context('fork')
+        with context.Pool(3, maxtasksperchild=1) as pool:
+            results = pool.map(_run_worker, [3, 4, 5, 6])
+
+        # Children only report their own work,
+        # having their reporter thread restarted.
+        for pid, nspans, nqueries in results:
+            self.assertNotEqual(os.getpid(), pid)
+            self.assertEqual(nspans, nqueries)
+        self.assertEqual([3, 4, 5, 6], sorted(result[2] for result in results))
+
+        # The parent process is left untouched.
+        self.assertEqual(2, sum(entry['count'] for entry in self.stats.snapshot().values()))
+        self.assertEqual(0, len(self.reporter.tracer.spans))
+        self.reporter.flush()
+        self.assertEqual(2, len(self.reporter.tracer.spans))
@@ -3,6 +3,7 @@ from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text
 
 import sqlalchemy_opentracing
 from .dummies import *
@@ -72,6 +73,75 @@ class TestSQLAlchemyORM(unittest.TestCase):
         self.assertEqual(True, all(map(lambda x: x.operation_name == 'insert', tracer.spans)))
         self.assertEqual(True, all(map(lambda x: x.is_finished, tracer.spans)))
 
+    def test_traced_n_plus_one(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False,
+                                            n_plus_one_threshold=2)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        session = self.session
+        session.add_all([User(name='John Doe'), User(name='Jason Bourne'),
+                         User(name='Foo Bar')])
+        session.commit()
+
+        sqlalchemy_opentracing.set_traced(session)
+        for user_id in (1, 2, 3):
+            session.query(User).filter(User.id == user_id).one()
+        session.commit()
+
+        self.assertEqual(3, len(tracer.spans))
+        self.assertEqual(True, all(map(lambda x: x.operation_name == 'select', tracer.spans)))
+        self.assertNotIn('sqlalchemy.n_plus_one', tracer.spans[0].tags)
+        self.assertNotIn('sqlalchemy.n_plus_one', tracer.spans[1].tags)
+        self.assertEqual(True, tracer.spans[2].tags['sqlalchemy.n_plus_one'])
+        self.assertEqual(3, tracer.spans[2].tags['sqlalchemy.n_plus_one.count'])
+
+        # Counters are released along the session tracing information.
+        tracer.clear()
+        sqlalchemy_opentracing.set_traced(session)
+        session.query(User).filter(User.id == 1).one()
+        session.commit()
+
+        self.assertEqual(1, len(tracer.spans))
+        self.assertNotIn('sqlalchemy.n_plus_one', tracer.spans[0].tags)
+
+    def test_traced_fetch(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_fetch=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        session = self.session
+        session.add(User(name='John Doe'))
+        session.add(User(name='Jason Bourne'))
+        session.commit()
+        self.assertEqual(2, len(session.query(User).all()))
+
+        self.assertEqual(3, len(tracer.spans))
+        self.assertEqual(True, all(map(lambda x: x.is_finished, tracer.spans)))
+        self.assertEqual('select', tracer.spans[2].operation_name)
+        self.assertEqual(2, tracer.spans[2].tags['db.rows_fetched'])
+
+    def test_traced_yield_per(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        session = self.session
+        session.add_all([User(name='User-%s' % i) for i in range(10)])
+        session.commit()
+        tracer.clear()
+
+        self.assertEqual(10, len([user for user in session.query(User).yield_per(3)]))
+
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual(True, tracer.spans[0].is_finished)
+        tags = tracer.spans[0].tags
+        self.assertEqual(True, tags['sqlalchemy.stream_results'])
+        self.assertEqual(10, tags['db.rows_fetched'])
+        self.assertEqual(True, tags['db.fetch_batches'] >= 4)
+        self.assertEqual(3, tags['db.rows_per_batch.max'])
+
     def test_traced_error(self):
         tracer = DummyTracer()
         sqlalchemy_opentracing.init_tracing(tracer, False, False)
@@ -102,6 +172,135 @@ class TestSQLAlchemyORM(unittest.TestCase):
             'error': 'true',
         })
 
+    def test_traced_flush(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False,
+                                            trace_flushes=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        session = self.session
+        session.add_all([User(name='John Doe'), User(name='Jason Bourne')])
+        session.commit()
+
+        # Only traced sessions get their flushes traced.
+        self.assertEqual(0, len(tracer.spans))
+
+        parent_span = DummySpan('parent span')
+        sqlalchemy_opentracing.set_parent_span(session, parent_span)
+        john, jason = session.query(User).order_by(User.id).all()
+        john.name = 'John Smith'
+        session.delete(jason)
+        session.add(User(name='Foo Bar'))
+        session.flush()
+        session.commit()
+
+        self.assertEqual(['select', 'flush', 'update', 'insert', 'delete'],
+                         [span.operation_name for span in tracer.spans])
+        flush_span = tracer.spans[1]
+        self.assertEqual(True, flush_span.is_finished)
+        self.assertEqual(parent_span, flush_span.child_of)
+        self.assertEqual(parent_span, tracer.spans[0].child_of)
+        self.assertEqual(True, all(map(lambda x: x.child_of == flush_span,
+                                       tracer.spans[2:])))
+        # Mapped classes are named along their module.
+        user_class = User.__module__ + '.User'
+        self.assertEqual(flush_span.tags, {
+            'component': 'sqlalchemy',
+            'db.type': 'sql',
+            'sqlalchemy.dialect': 'sqlite',
+            'sqlalchemy.flush.new': 1,
+            'sqlalchemy.flush.new.' + user_class: 1,
+            'sqlalchemy.flush.dirty': 1,
+            'sqlalchemy.flush.dirty.' + user_class: 1,
+            'sqlalchemy.flush.deleted': 1,
+            'sqlalchemy.flush.deleted.' + user_class: 1,
+        })
+
+        # Queries after the flush are not part of it.
+        tracer.clear()
+        sqlalchemy_opentracing.set_parent_span(session, parent_span)
+        session.query(User).all()
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual(parent_span, tracer.spans[0].child_of)
+        session.commit()
+
+    def test_traced_flush_error(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_flushes=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        session = self.session
+        session.add(User(name='John Doe', id=1))
+        session.commit()
+
+        tracer.clear()
+        session.add(User(name='John Doe', id=1))
+        with self.assertRaises(IntegrityError):
+            session.commit()
+
+        self.assertEqual(['flush', 'insert'],
+                         [span.operation_name for span in tracer.spans])
+        self.assertEqual(True, tracer.spans[0].is_finished)
+        self.assertEqual('true', tracer.spans[0].tags['error'])
+        self.assertEqual(tracer.spans[0], tracer.spans[1].child_of)
+        self.assertEqual(False, sqlalchemy_opentracing.FLUSH_SPAN_KEY in session.info)
+
+    def test_traced_flush_no_work(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            trace_flushes=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        session = self.session
+        session.add_all([User(name='John Doe'), User(name='Jason Bourne')])
+        session.commit()
+        john, jason = session.query(User).order_by(User.id).all()
+
+        # Nothing to write for the clean object, while the other one is dirty.
+        tracer.clear()
+        jason.name = 'Jason Smith'
+        session.flush(objects=[john])
+        self.assertEqual(['flush'], [span.operation_name for span in tracer.spans])
+        flush_span = tracer.spans[0]
+
+        # Later queries don't belong to the flush, whose span
+        # gets finished by the next one.
+        other_session = sessionmaker(bind=self.engine)()
+        other_session.query(User).all()
+        session.execute(text('SELECT 1'))
+        session.query(User).filter(User.id == john.id).all()
+        self.assertEqual(True, flush_span.is_finished)
+        self.assertEqual(False, 'error' in flush_span.tags)
+        self.assertEqual(False, sqlalchemy_opentracing.FLUSH_SPAN_KEY in session.info)
+        self.assertEqual(['flush', 'select', 'textclause', 'flush', 'update', 'select'],
+                         [span.operation_name for span in tracer.spans])
+        self.assertEqual(None, tracer.spans[1].child_of)
+        self.assertEqual(None, tracer.spans[2].child_of)
+        self.assertEqual(tracer.spans[3], tracer.spans[4].child_of)
+        self.assertEqual(None, tracer.spans[5].child_of)
+        other_session.close()
+        session.commit()
+
+    def test_traced_transaction_span(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False,
+                                            trace_transactions=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        parent_span = DummySpan('parent span')
+        session = self.session
+        sqlalchemy_opentracing.set_parent_span(session, parent_span)
+        session.add(User(name='John Doe'))
+        session.commit()
+
+        self.assertEqual(['transaction', 'insert'],
+                         [span.operation_name for span in tracer.spans])
+        self.assertEqual(parent_span, tracer.spans[0].child_of)
+        self.assertEqual(True, tracer.spans[0].is_finished)
+        self.assertEqual('commit', tracer.spans[0].tags['sqlalchemy.transaction.outcome'])
+        self.assertEqual(1, tracer.spans[0].tags['sqlalchemy.transaction.statements'])
+
     def test_traced_parent(self):
         tracer = DummyTracer()
         sqlalchemy_opentracing.init_tracing(tracer, False, False)
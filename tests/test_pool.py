@@ -0,0 +1,150 @@
+import threading
+import time
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing import pooling
+from .dummies import *
+
+class TestPoolTracing(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:', poolclass=QueuePool,
+                                    pool_size=1, max_overflow=1)
+        self.tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(self.tracer, False, trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+        sqlalchemy_opentracing.register_pool(self.engine)
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_pool(self.engine)
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_checkout_tags(self):
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+            conn.execute('SELECT 2')
+
+        self.assertEqual(2, len(self.tracer.spans))
+        tags = self.tracer.spans[0].tags
+        self.assertEqual(1, tags['db.pool.size'])
+        self.assertEqual(1, tags['db.pool.checked_out'])
+        self.assertEqual(0, tags['db.pool.overflow'])
+        self.assertEqual(0, tags['db.pool.invalidations'])
+        self.assertEqual(True, tags['db.pool.checkout_wait'] >= 0)
+        self.assertEqual(True, tags['db.pool.connection_age'] >= 0)
+
+        # Only the first span of a checkout is tagged.
+        self.assertEqual(False, 'db.pool.checkout_wait' in self.tracer.spans[1].tags)
+
+    def test_overflow(self):
+        with self.engine.connect():
+            with self.engine.connect() as conn2:
+                conn2.execute('SELECT 1')
+
+        tags = self.tracer.spans[0].tags
+        self.assertEqual(2, tags['db.pool.checked_out'])
+        self.assertEqual(1, tags['db.pool.overflow'])
+
+    def test_checkout_wait(self):
+        engine = create_engine('sqlite:///:memory:', poolclass=QueuePool,
+                               pool_size=1, max_overflow=0,
+                               connect_args={'check_same_thread': False})
+        sqlalchemy_opentracing.register_engine(engine)
+        sqlalchemy_opentracing.register_pool(engine)
+
+        conn = engine.connect()
+        def release():
+            time.sleep(0.1)
+            conn.close()
+
+        thread = threading.Thread(target=release)
+        thread.start()
+        with engine.connect() as conn2:
+            conn2.execute('SELECT 1')
+        thread.join()
+
+        sqlalchemy_opentracing.unregister_pool(engine)
+        sqlalchemy_opentracing.unregister_engine(engine)
+
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual(True, self.tracer.spans[0].tags['db.pool.checkout_wait'] >= 0.05)
+
+    def test_invalidate(self):
+        with self.engine.connect() as conn:
+            conn.invalidate()
+
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        self.assertEqual(1, self.tracer.spans[0].tags['db.pool.invalidations'])
+
+    def test_dispose(self):
+        self.engine.dispose()
+
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        self.assertEqual(True, 'db.pool.checkout_wait' in self.tracer.spans[0].tags)
+
+    def test_dispose_invalidate(self):
+        self.engine.dispose()
+
+        with self.engine.connect() as conn:
+            conn.invalidate()
+
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        # Listeners are not registered twice.
+        self.assertEqual(1, self.tracer.spans[0].tags['db.pool.invalidations'])
+
+    def test_dispose_unregister(self):
+        self.engine.dispose()
+        sqlalchemy_opentracing.unregister_pool(self.engine)
+
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        self.assertEqual(False, 'db.pool.checkout_wait' in self.tracer.spans[0].tags)
+
+    def test_dispose_register_again(self):
+        self.engine.dispose()
+        sqlalchemy_opentracing.unregister_pool(self.engine)
+        self.engine.dispose()
+        sqlalchemy_opentracing.register_pool(self.engine)
+
+        with self.engine.connect() as conn:
+            conn.invalidate()
+
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        # Listeners copied over by dispose() are reused, not accumulated.
+        self.assertEqual(1, len(self.engine.pool.dispatch.checkout))
+        self.assertEqual(1, self.tracer.spans[0].tags['db.pool.invalidations'])
+
+    def test_disable_tracing(self):
+        sqlalchemy_opentracing.disable_tracing(self.engine)
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        self.assertEqual(0, len(self.tracer.spans))
+        self.assertEqual(None, pooling.g_checkout_wait_time.get())
+
+        sqlalchemy_opentracing.enable_tracing(self.engine)
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        self.assertEqual(True, 'db.pool.checkout_wait' in self.tracer.spans[0].tags)
+
+    def test_unregister(self):
+        sqlalchemy_opentracing.unregister_pool(self.engine)
+        self.assertEqual(False, self.engine in pooling.g_instrumented)
+
+        with self.engine.connect() as conn:
+            conn.execute('SELECT 1')
+
+        self.assertEqual(False, 'db.pool.checkout_wait' in self.tracer.spans[0].tags)
@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.fingerprint import get_fingerprint
+from sqlalchemy_opentracing.querylog import QueryLogReader, QueryLogWriter, read_query_log
+from sqlalchemy_opentracing.records import QueryRecord
+from .dummies import *
+
+def _record(i, operation='select', error=False):
+    return QueryRecord(1000.0 + i, 0.25, operation, 'postgresql',
+                       '%016x' % (i + 1), error)
+
+class TestQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.log_dir, 'queries.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_read_write(self):
+        writer = QueryLogWriter(self.path, capacity=10)
+        writer.record(_record(0))
+        writer.record(_record(1, 'insert', error=True))
+
+        # Records are readable while being written.
+        records = read_query_log(self.path)
+        writer.close()
+
+        self.assertEqual([{
+            'timestamp': 1000.0,
+            'duration': 0.25,
+            'operation': 'select',
+            'dialect': 'postgresql',
+            'fingerprint': '0000000000000001',
+            'error': False,
+        }, {
+            'timestamp': 1001.0,
+            'duration': 0.25,
+            'operation': 'insert',
+            'dialect': 'postgresql',
+            'fingerprint': '0000000000000002',
+            'error': True,
+        }], [record.to_dict() for record in records])
+
+    def test_ring_buffer(self):
+        writer = QueryLogWriter(self.path, capacity=3)
+        for i in range(7):
+            writer.record(_record(i))
+        writer.close()
+
+        # Only the last ones are kept, oldest first.
+        reader = QueryLogReader(self.path)
+        self.assertEqual(3, reader.capacity)
+        self.assertEqual(3, len(reader))
+        self.assertEqual([1004.0, 1005.0, 1006.0],
+                         [record.timestamp for record in reader])
+        self.assertEqual(3 * 72 + 32, os.path.getsize(self.path))
+
+    def test_append(self):
+        writer = QueryLogWriter(self.path, capacity=3)
+        writer.record(_record(0))
+        writer.record(_record(1))
+        writer.close()
+
+        writer = QueryLogWriter(self.path, capacity=3)
+        writer.record(_record(2))
+        writer.record(_record(3))
+        writer.close()
+        self.assertEqual([1001.0, 1002.0, 1003.0],
+                         [record.timestamp for record in read_query_log(self.path)])
+
+        # A different capacity starts over.
+        writer = QueryLogWriter(self.path, capacity=5)
+        writer.record(_record(4))
+        writer.close()
+        self.assertEqual([1004.0],
+                         [record.timestamp for record in read_query_log(self.path)])
+
+    def test_long_names(self):
+        writer = QueryLogWriter(self.path, capacity=3)
+        writer.record(_record(0, 'select_' + 'x' * 40))
+        writer.close()
+
+        # Names are truncated to their fixed width.
+        self.assertEqual('select_' + 'x' * 16,
+                         read_query_log(self.path)[0].operation)
+
+    def test_pid_path(self):
+        writer = QueryLogWriter(os.path.join(self.log_dir, 'queries-{pid}.log'))
+        writer.close()
+        self.assertEqual(os.path.join(self.log_dir, 'queries-%s.log' % os.getpid()),
+                         writer.path)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            QueryLogWriter(self.path, capacity=0)
+
+        with open(self.path, 'w') as f:
+            f.write('not a query log file')
+
+        # Other files are never overwritten.
+        with self.assertRaises(ValueError):
+            QueryLogWriter(self.path)
+        with self.assertRaises(ValueError):
+            QueryLogReader(self.path)
+
+class TestQueryLogEngine(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.log_dir, 'queries.log')
+        self.engine = create_engine('sqlite:///:memory:')
+        self.users_table = Table('users', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('name', String),
+        )
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+        shutil.rmtree(self.log_dir)
+
+    def test_traced(self):
+        tracer = DummyTracer()
+        writer = QueryLogWriter(self.path, capacity=100)
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=True,
+                                            query_recorder=writer)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        try:
+            self.engine.execute(CreateTable(self.users_table))
+        except OperationalError:
+            pass
+        writer.close()
+
+        records = read_query_log(self.path)
+        self.assertEqual(3, len(tracer.spans))
+        self.assertEqual(['create_table', 'insert', 'create_table'],
+                         [record.operation for record in records])
+        self.assertEqual([False, False, True],
+                         [record.error for record in records])
+        self.assertEqual(set(['sqlite']), set(record.dialect for record in records))
+        self.assertEqual(get_fingerprint('INSERT INTO users (name) VALUES (?)')[1],
+                         records[1].fingerprint)
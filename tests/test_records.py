@@ -0,0 +1,104 @@
+import time
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.fingerprint import get_fingerprint
+from sqlalchemy_opentracing.records import QueryRecord, QueryRecordBuffer
+from .dummies import *
+
+class TestQueryRecord(unittest.TestCase):
+    def test_record(self):
+        record = QueryRecord(1000.0, 0.5, 'select', 'sqlite', 'abc', True)
+        self.assertEqual({
+            'timestamp': 1000.0,
+            'duration': 0.5,
+            'operation': 'select',
+            'dialect': 'sqlite',
+            'fingerprint': 'abc',
+            'error': True,
+        }, record.to_dict())
+
+        # No per-instance dict.
+        with self.assertRaises(AttributeError):
+            record.statement = 'SELECT 1'
+
+    def test_interned_fingerprint(self):
+        fingerprint = ''.join(['ab', 'cd'])
+        record = QueryRecord(1000.0, 0.5, 'select', 'sqlite', fingerprint)
+        other = QueryRecord(1000.0, 0.5, 'select', 'sqlite', ''.join(['abc', 'd']))
+        self.assertIs(record.fingerprint, other.fingerprint)
+
+class TestQueryRecordBuffer(unittest.TestCase):
+    def test_drain(self):
+        buf = QueryRecordBuffer()
+        for i in range(3):
+            buf.record(QueryRecord(i, 0.1, 'select', 'sqlite', 'abc'))
+
+        self.assertEqual(3, len(buf))
+        self.assertEqual([0, 1, 2], [record.timestamp for record in buf.drain()])
+        self.assertEqual(0, len(buf))
+        self.assertEqual([], buf.drain())
+
+    def test_max_records(self):
+        buf = QueryRecordBuffer(max_records=2)
+        for i in range(5):
+            buf.record(QueryRecord(i, 0.1, 'select', 'sqlite', 'abc'))
+
+        # Only the last ones are kept.
+        self.assertEqual([3, 4], [record.timestamp for record in buf.drain()])
+
+class TestQueryRecorderEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.users_table = Table('users', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('name', String),
+        )
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_no_tracer(self):
+        buf = QueryRecordBuffer()
+        sqlalchemy_opentracing.init_tracing(None, False, query_recorder=buf)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        start_time = time.time()
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        try:
+            self.engine.execute(CreateTable(self.users_table))
+        except OperationalError:
+            pass
+
+        records = buf.drain()
+        self.assertEqual(['create_table', 'insert', 'create_table'],
+                         [record.operation for record in records])
+        self.assertEqual([False, False, True],
+                         [record.error for record in records])
+        self.assertEqual(set(['sqlite']), set(record.dialect for record in records))
+        self.assertEqual(get_fingerprint('INSERT INTO users (name) VALUES (?)')[1],
+                         records[1].fingerprint)
+        for record in records:
+            self.assertTrue(record.timestamp >= start_time - 0.01)
+            self.assertTrue(record.duration >= 0.0)
+
+    def test_with_tracer(self):
+        tracer = DummyTracer()
+        buf = QueryRecordBuffer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=False,
+                                            query_recorder=buf)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        creat = CreateTable(self.users_table)
+        sqlalchemy_opentracing.set_traced(creat)
+        self.engine.execute(creat)
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+
+        # Records are kept for all queries.
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual(2, len(buf))
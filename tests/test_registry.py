@@ -0,0 +1,110 @@
+import gc
+import unittest
+import weakref
+from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.registry import TracingRegistry
+from .dummies import *
+
+Base = declarative_base()
+
+class User(Base):
+    __tablename__ = 'users'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+class TestTracingRegistry(unittest.TestCase):
+    def test_state(self):
+        registry = TracingRegistry()
+        span = DummySpan()
+        self.assertEqual(None, registry.get(span))
+
+        state = registry.setdefault(span)
+        self.assertEqual(False, state.has_parent_span())
+        self.assertEqual(None, state.get_parent_span())
+        self.assertEqual(state, registry.get(span))
+        self.assertEqual(state, registry.setdefault(span))
+
+        self.assertEqual(state, registry.pop(span))
+        self.assertEqual(None, registry.get(span))
+        self.assertEqual(None, registry.pop(span))
+
+    def test_weak(self):
+        registry = TracingRegistry()
+        parent_span = DummySpan('parent')
+        parent_ref = weakref.ref(parent_span)
+
+        stmt = select([User.__table__])
+        registry.setdefault(stmt).parent_span = parent_span
+        del parent_span
+        self.assertEqual(1, len(registry))
+
+        del stmt
+        gc.collect()
+        self.assertEqual(0, len(registry))
+        self.assertEqual(None, parent_ref())
+
+class TestTracingRegistryMemory(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.session = sessionmaker(bind=self.engine)()
+        User.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_unexecuted_statements(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+        registry = sqlalchemy_opentracing.g_registry
+
+        # Statements marked but never executed.
+        parent_refs = []
+        for i in range(100):
+            parent_span = DummySpan('parent-%s' % i)
+            parent_refs.append(weakref.ref(parent_span))
+            sel = select([User.__table__])
+            sqlalchemy_opentracing.set_parent_span(sel, parent_span)
+
+        del sel, parent_span
+        gc.collect()
+
+        self.assertEqual(0, len(registry))
+        self.assertEqual(True, all(map(lambda x: x() is None, parent_refs)))
+
+    def test_long_lived_session(self):
+        tracer = DummyTracer()
+        sqlalchemy_opentracing.init_tracing(tracer, False, False)
+        sqlalchemy_opentracing.register_engine(self.engine)
+        registry = sqlalchemy_opentracing.g_registry
+
+        session = self.session
+        parent_refs = []
+        sizes = []
+        for i in range(100):
+            parent_span = DummySpan('parent-%s' % i)
+            parent_refs.append(weakref.ref(parent_span))
+
+            sqlalchemy_opentracing.set_parent_span(session, parent_span)
+            session.add(User(name='User-%s' % i))
+            session.query(User).filter(User.name == 'User-%s' % i).all()
+
+            # Statements not executed at all.
+            sqlalchemy_opentracing.set_parent_span(select([User.__table__]), parent_span)
+
+            session.commit()
+            tracer.clear()
+            del parent_span
+
+            gc.collect()
+            sizes.append(len(registry))
+
+        self.assertEqual([0] * 100, sizes)
+        self.assertEqual(True, all(map(lambda x: x() is None, parent_refs)))
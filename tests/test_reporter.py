@@ -0,0 +1,115 @@
+import time
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.reporter import AsyncFinishTracer
+from .dummies import *
+
+class TestAsyncFinishTracer(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.users_table = Table('users', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('name', String),
+        )
+        self.tracer = DummyTracer()
+        self.async_tracer = AsyncFinishTracer(self.tracer, flush_interval=60)
+        sqlalchemy_opentracing.init_tracing(self.async_tracer, False,
+                                            trace_all_queries=True)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+    def tearDown(self):
+        self.async_tracer.close()
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_deferred(self):
+        creat = CreateTable(self.users_table)
+        self.engine.execute(creat)
+        try:
+            self.engine.execute(creat)
+        except OperationalError:
+            pass
+
+        # Nothing reaches the actual tracer till flushed.
+        self.assertEqual(0, len(self.tracer.spans))
+
+        self.async_tracer.flush()
+        self.assertEqual(2, len(self.tracer.spans))
+        self.assertEqual(True, all(map(lambda x: x.is_finished, self.tracer.spans)))
+        self.assertEqual(['create_table', 'create_table'],
+                         [span.operation_name for span in self.tracer.spans])
+        self.assertEqual('sqlite', self.tracer.spans[0].tags['sqlalchemy.dialect'])
+        self.assertEqual('true', self.tracer.spans[1].tags['error'])
+
+        span = self.tracer.spans[0]
+        self.assertEqual(True, span.start_time <= span.finish_time)
+
+    def test_deferred_parent(self):
+        parent = self.async_tracer.start_span('parent')
+        child = self.async_tracer.start_span('child', child_of=parent)
+        child.set_tag('foo', 'bar')
+        child.log_kv({'event': 'baz'})
+        child.finish()
+        parent.finish()
+
+        self.async_tracer.flush()
+        self.assertEqual(['parent', 'child'],
+                         [span.operation_name for span in self.tracer.spans])
+        self.assertEqual(self.tracer.spans[0], self.tracer.spans[1].child_of)
+        self.assertEqual({'foo': 'bar'}, self.tracer.spans[1].tags)
+        self.assertEqual({'event': 'baz'}, self.tracer.spans[1].logs[0][0])
+        self.assertEqual(True, all(map(lambda x: x.is_finished, self.tracer.spans)))
+
+    def test_deferred_references(self):
+        references = [object()]
+        span = self.async_tracer.start_span('span', references=references)
+        span.finish()
+
+        self.async_tracer.flush()
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual(references, self.tracer.spans[0].references)
+
+    def test_deferred_context(self):
+        span = self.async_tracer.start_span('span')
+
+        # The actual span is created as soon as its context is needed.
+        context = span.context
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual(self.tracer.spans[0].context, context)
+        self.assertEqual(False, self.tracer.spans[0].is_finished)
+
+        span.set_tag('foo', 'bar')
+        span.finish()
+        self.async_tracer.flush()
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual({'foo': 'bar'}, self.tracer.spans[0].tags)
+        self.assertEqual(True, self.tracer.spans[0].is_finished)
+
+    def test_dropped(self):
+        async_tracer = AsyncFinishTracer(self.tracer, max_queue_size=2,
+                                         flush_interval=60)
+        for i in range(5):
+            async_tracer.start_span('span-%s' % i).finish()
+
+        self.assertEqual(3, async_tracer.dropped)
+
+        async_tracer.close()
+        self.assertEqual(['span-0', 'span-1'],
+                         [span.operation_name for span in self.tracer.spans])
+
+    def test_background_thread(self):
+        async_tracer = AsyncFinishTracer(self.tracer, flush_interval=0.01)
+        async_tracer.start_span('span').finish()
+
+        for i in range(100):
+            if self.tracer.spans:
+                break
+            time.sleep(0.01)
+
+        async_tracer.close()
+        self.assertEqual(1, len(self.tracer.spans))
+        self.assertEqual(True, self.tracer.spans[0].is_finished)
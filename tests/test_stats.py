@@ -0,0 +1,120 @@
+import unittest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+
+import sqlalchemy_opentracing
+from sqlalchemy_opentracing.stats import OVERFLOW_KEY, CompiledCacheStats, QueryStats
+from .dummies import *
+
+class TestQueryStats(unittest.TestCase):
+    def test_record(self):
+        stats = QueryStats(buckets=(0.1, 1.0))
+        stats.record('select', ('SELECT ?', 'abc'), 0.05)
+        stats.record('select', ('SELECT ?', 'abc'), 0.5)
+        stats.record('select', ('SELECT ?', 'abc'), 2.0, error=True)
+
+        self.assertEqual(stats.snapshot(), {
+            ('select', 'abc'): {
+                'statement': 'SELECT ?',
+                'count': 3,
+                'total_time': 2.55,
+                'errors': 1,
+                'histogram': [1, 1, 1],
+            }
+        })
+
+    def test_snapshot_reset(self):
+        stats = QueryStats()
+        stats.record('select', ('SELECT ?', 'abc'), 0.05)
+
+        self.assertEqual(1, len(stats.snapshot(reset=True)))
+        self.assertEqual({}, stats.snapshot())
+
+        stats.record('select', ('SELECT ?', 'abc'), 0.05)
+        stats.reset()
+        self.assertEqual({}, stats.snapshot())
+
+    def test_max_keys(self):
+        stats = QueryStats(max_keys=2)
+        for i in range(5):
+            stats.record('select', ('SELECT %s' % i, str(i)), 0.01)
+        stats.record('select', ('SELECT 0', '0'), 0.01)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(set([('select', '0'), ('select', '1'), OVERFLOW_KEY]),
+                         set(snapshot.keys()))
+        self.assertEqual(2, snapshot[('select', '0')]['count'])
+        self.assertEqual(3, snapshot[OVERFLOW_KEY]['count'])
+        self.assertEqual(None, snapshot[OVERFLOW_KEY]['statement'])
+
+    def test_max_keys_invalid(self):
+        with self.assertRaises(ValueError):
+            QueryStats(max_keys=0)
+
+class TestQueryStatsEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.users_table = Table('users', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('name', String),
+        )
+
+    def tearDown(self):
+        sqlalchemy_opentracing.unregister_engine(self.engine)
+        sqlalchemy_opentracing._clear_tracer()
+
+    def test_no_tracer(self):
+        stats = QueryStats()
+        sqlalchemy_opentracing.init_tracing(None, False, query_stats=stats)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        self.engine.execute(CreateTable(self.users_table))
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+        self.engine.execute(self.users_table.insert().values(name='Jason Bourne'))
+        try:
+            self.engine.execute(CreateTable(self.users_table))
+        except OperationalError:
+            pass
+
+        snapshot = stats.snapshot()
+        by_operation = dict((key[0], value) for key, value in snapshot.items())
+        self.assertEqual(set(['create_table', 'insert']), set(by_operation.keys()))
+        self.assertEqual(2, by_operation['insert']['count'])
+        self.assertEqual(0, by_operation['insert']['errors'])
+        self.assertEqual('INSERT INTO users (name) VALUES (?)',
+                         by_operation['insert']['statement'])
+        self.assertEqual(2, by_operation['create_table']['count'])
+        self.assertEqual(1, by_operation['create_table']['errors'])
+
+    def test_with_tracer(self):
+        tracer = DummyTracer()
+        stats = QueryStats()
+        sqlalchemy_opentracing.init_tracing(tracer, False, trace_all_queries=False,
+                                            query_stats=stats)
+        sqlalchemy_opentracing.register_engine(self.engine)
+
+        creat = CreateTable(self.users_table)
+        sqlalchemy_opentracing.set_traced(creat)
+        self.engine.execute(creat)
+        self.engine.execute(self.users_table.insert().values(name='John Doe'))
+
+        # Statistics are gathered for all queries.
+        self.assertEqual(1, len(tracer.spans))
+        self.assertEqual(2, len(stats.snapshot()))
+
+class TestCompiledCacheStats(unittest.TestCase):
+    def test_record(self):
+        stats = CompiledCacheStats()
+        self.assertEqual({'hit_ratio': None}, stats.snapshot())
+
+        for status in ('miss', 'hit', 'hit', 'hit', 'no_key'):
+            stats.record(status)
+
+        self.assertEqual({
+            'hit': 3,
+            'miss': 1,
+            'no_key': 1,
+            'hit_ratio': 0.75,
+        }, stats.snapshot(reset=True))
+        self.assertEqual({'hit_ratio': None}, stats.snapshot())